@@ -4,44 +4,23 @@
 const bucketName = 'logan-public-files';
 const region = 'us-east-2';
 const folderPrefix = 'projects/';
+const indexKey = `${folderPrefix}projects.json`;
 const s3Endpoint = `https://${bucketName}.s3.${region}.amazonaws.com/`;
 
 // Fetch and display project data
 async function fetchAndDisplayProjects() {
     try {
-        // Fetch list of JSON files from S3
-        const url = `${s3Endpoint}?list-type=2&prefix=${encodeURIComponent(folderPrefix)}`;
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: { 'Content-Type': 'application/xml' },
-        });
-
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const textData = await response.text();
-        const parser = new DOMParser();
-        const xml = parser.parseFromString(textData, "application/xml");
-        const contents = xml.getElementsByTagName("Contents");
+        const projectContainer = document.querySelector('.grid');
 
-        const jsonFiles = [];
-        for (let i = 0; i < contents.length; i++) {
-            const key = contents[i].getElementsByTagName("Key")[0].textContent;
-            if (key.endsWith('.json') && key !== folderPrefix) {
-                jsonFiles.push(key);
-            }
-        }
+        // Prefer the pre-built index, one request for every project card
+        const index = await fetchProjectData(`${s3Endpoint}${indexKey}`);
 
-        // Fetch and display each JSON file's content
-        const projectContainer = document.querySelector('.grid');
-        for (const fileKey of jsonFiles) {
-            const jsonUrl = `${s3Endpoint}${encodeURIComponent(fileKey)}`;
-            let projectData = await fetchProjectData(jsonUrl);
-            projectData['jsonname'] = fileKey;
-            if (projectData) {
+        if (Array.isArray(index)) {
+            for (const projectData of index) {
                 addProjectToGrid(projectContainer, projectData);
             }
+        } else {
+            await fetchProjectsIndividually(projectContainer);
         }
 
         // init Masonry
@@ -60,6 +39,42 @@ async function fetchAndDisplayProjects() {
     }
 }
 
+// Fallback for when no index exists, list the bucket and fetch every project
+async function fetchProjectsIndividually(projectContainer) {
+    // Fetch list of JSON files from S3. Only the top level, project bodies and icons sit in folders below
+    const url = `${s3Endpoint}?list-type=2&prefix=${encodeURIComponent(folderPrefix)}&delimiter=%2F`;
+    const response = await fetch(url, {
+        method: 'GET',
+        headers: { 'Content-Type': 'application/xml' },
+    });
+
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const textData = await response.text();
+    const parser = new DOMParser();
+    const xml = parser.parseFromString(textData, "application/xml");
+    const contents = xml.getElementsByTagName("Contents");
+
+    const jsonFiles = [];
+    for (let i = 0; i < contents.length; i++) {
+        const key = contents[i].getElementsByTagName("Key")[0].textContent;
+        if (key.endsWith('.json') && key !== folderPrefix && key !== indexKey) {
+            jsonFiles.push(key);
+        }
+    }
+
+    // Fetch every JSON file's content at once, then display in listing order
+    const allProjectData = await Promise.all(jsonFiles.map(fileKey => fetchProjectData(`${s3Endpoint}${encodeURIComponent(fileKey)}`)));
+    allProjectData.forEach((projectData, index) => {
+        if (projectData) {
+            projectData['jsonname'] = jsonFiles[index];
+            addProjectToGrid(projectContainer, projectData);
+        }
+    });
+}
+
 // Fetch individual project data
 async function fetchProjectData(jsonUrl) {
     try {
@@ -12,8 +12,62 @@ function getUrlParams() {
     return params;
 }
 
+// Technology icons are stored once, in projects/icons/, and listed by projects as icon:<id>
+const ICON_PREFIX = 'icon:';
+
+// Fetch the markup of every technology, in order. Older projects list their svgs inline
+async function loadTechnologies(technologies, iconBase) {
+    const markup = await Promise.all(technologies.map(async (technology) => {
+        if (!technology.startsWith(ICON_PREFIX)) {
+            return technology;
+        }
+
+        const iconUrl = `${iconBase}${technology.slice(ICON_PREFIX.length)}.svg`;
+
+        try {
+            const response = await fetch(iconUrl);
+            if (!response.ok) {
+                throw new Error(`Failed to fetch icon: ${response.status}`);
+            }
+            return await response.text();
+        } catch (error) {
+            console.error(`Error fetching icon from ${iconUrl}:`, error);
+            return '';
+        }
+    }));
+
+    return markup.join(' ');
+}
+
+// Load the project text. Newer projects keep it in body documents beside the json, listed under projectBody
+async function loadProjectText(data, baseUrl) {
+    const projectText = document.getElementById('project-text');
+    if (!projectText) {
+        return;
+    }
+
+    // Single file format, the text came with everything else
+    if (data.projectText) {
+        projectText.innerHTML = data.projectText;
+        return;
+    }
+
+    if (!data.projectBody) {
+        return;
+    }
+
+    // Every body is requested at once, each is shown as soon as those before it are
+    const bodies = data.projectBody.map((bodyPath) => axios.get(baseUrl + bodyPath).then((response) => response.data.projectText));
+
+    projectText.innerHTML = '';
+
+    for (const body of bodies) {
+        projectText.insertAdjacentHTML('beforeend', await body);
+    }
+}
+
 // Function to populate the HTML with JSON data
-function populateProject(data) {
+function populateProject(data, iconBase) {
     // Update the <title>
     if (data.projectShortTitle) {
         document.title = data.projectShortTitle;
@@ -35,7 +89,8 @@ function populateProject(data) {
     const projectImage = document.getElementById('project-image');
     if (projectImage && data.projectImage) {
         projectImage.innerHTML = data.projectImage;
-        projectImage.children[0].id = 'img-id';
+        // The image may be wrapped in a <picture> with its responsive variants
+        projectImage.querySelector('img').id = 'img-id';
         // projectImage.children[0].classList.add('proj-image');
     }
 
@@ -48,13 +103,9 @@ function populateProject(data) {
     // Update applicable technologies
     const applicableTechnologies = document.getElementById('applicable-technologies');
     if (applicableTechnologies && data.applicableTechnologies) {
-        applicableTechnologies.innerHTML = data.applicableTechnologies.join(' ');
-    }
-
-    // Update project text
-    const projectText = document.getElementById('project-text');
-    if (projectText && data.projectText) {
-        projectText.innerHTML = data.projectText;
+        loadTechnologies(data.applicableTechnologies, iconBase).then((markup) => {
+            applicableTechnologies.innerHTML = markup;
+        });
     }
 
     // Add tags
@@ -83,12 +134,20 @@ async function loadProject() {
 
         jsonFile = 'https://logan-public-files.s3.us-east-2.amazonaws.com/projects/' + jsonFile
 
+    }
+    else{
+
+        listenForReload();
+
     }
 
     try {
         const response = await axios.get(jsonFile);
         const data = response.data;
-        populateProject(data);
+        // Icons and bodies sit beside the project json, locally and in the bucket
+        const baseUrl = jsonFile.slice(0, jsonFile.lastIndexOf('/') + 1);
+        populateProject(data, baseUrl + 'icons/');
+        await loadProjectText(data, baseUrl);
     } catch (error) {
         console.error("Error loading the project JSON file:", error);
     }
@@ -97,6 +156,16 @@ async function loadProject() {
     adjustImageHeight();
 }
 
+// Local preview only: the preview server announces recompiles over server-sent events
+function listenForReload() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    const events = new EventSource('/__events');
+    events.addEventListener('reload', () => window.location.reload());
+}
+
 // Execute the main function after the DOM is fully loaded
 document.addEventListener('DOMContentLoaded', loadProject);
 
@@ -0,0 +1,325 @@
+'''
+Derived assets, made before their sources are published.
+
+Every png / jpg is re-encoded at a few widths, as AVIF and WebP (when Pillow can write them) plus a JPEG fallback,
+and every mp4 / mov gets a poster frame, so the page can show it without fetching any of the video.
+Both are cached on disk by the content hash of their source, so an unchanged file is never processed twice,
+and the hash itself is only worked out again once the file's mtime or size changes.
+
+Variants need Pillow, posters need ffmpeg (on the PATH, or from the imageio-ffmpeg package).
+Without them, files are published exactly as they are
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from s3_utils import hash_file
+
+VARIANT_DIRECTORY = '.cache/variants'
+
+VARIANT_WIDTHS = (480, 960, 1600)
+VARIANT_QUALITY = 80
+
+IMAGE_TYPES = ('png', 'jpg', 'jpeg')
+
+POSTER_DIRECTORY = '.cache/posters'
+
+VIDEO_TYPES = ('mp4', 'mov')
+
+POSTER_TIME = 1 # Seconds in, past the black of a fade in
+POSTER_MAX_WIDTH = 1600
+POSTER_TIMEOUT = 60 # Seconds
+
+# Best first, the browser takes the first source it can decode
+MODERN_FORMATS = ('avif', 'webp')
+FALLBACK_FORMAT = 'jpg'
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg',
+}
+
+PILLOW_FORMATS = {
+    'avif': 'AVIF',
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+@lru_cache(maxsize = None)
+def load_pillow():
+    '''Pillow's Image module, or None without Pillow. Imported on first use, it is slow to import and rarely needed'''
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    return Image
+
+def available_formats():
+    '''The variant formats this Pillow can write, best first. Empty without Pillow'''
+
+    if load_pillow() is None:
+        return []
+
+    from PIL import features
+
+    formats = []
+
+    for name in MODERN_FORMATS:
+        try:
+            if features.check_module(name):
+                formats.append(name)
+        except ValueError:
+            # Pillow too old to know about this format
+            pass
+
+    return formats + [FALLBACK_FORMAT]
+
+def is_image(file_path: str):
+    return os.path.basename(file_path).partition('.')[2].lower() in IMAGE_TYPES
+
+def is_video(file_path: str):
+    return os.path.basename(file_path).partition('.')[2].lower() in VIDEO_TYPES
+
+@lru_cache(maxsize = 1024)
+def hash_file_version(file_path: str, mtime_ns: int, size: int):
+    return hash_file(file_path)
+
+def cached_hash_file(file_path: str):
+    '''
+    hash_file, remembered for as long as the file's mtime and size stay the same.
+
+    Every preview compile looks up the variants of every image and the poster of every video,
+    so without this each one would re-read all of them in full
+    '''
+
+    stat = os.stat(file_path)
+
+    return hash_file_version(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+def variant_key(file_hash: str, widths, formats, quality):
+    '''Names the cache entry, which changes with the image or with any encoding setting'''
+
+    return hashlib.sha256(json.dumps([file_hash, list(widths), list(formats), quality]).encode()).hexdigest()[:32]
+
+def cached_variants(directory: str):
+
+    try:
+        with open(os.path.join(directory, 'variants.json')) as listing_file:
+            return json.load(listing_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def encode_variants(image_path: str, directory: str, widths, formats, quality):
+    '''
+    Encode the variants of one image into directory. Runs in a worker process.
+
+    Returns a list of [path, width, format]. Images are never scaled up, and transparent images get no JPEG fallback.
+    A file Pillow cannot read gets no variants, which is cached like any other result
+    '''
+
+    Image = load_pillow()
+
+    os.makedirs(directory, exist_ok = True)
+
+    name = os.path.basename(image_path)
+
+    variants = []
+
+    try:
+        with Image.open(image_path) as source:
+
+            has_alpha = source.mode in ('RGBA', 'LA', 'PA') or (source.mode == 'P' and 'transparency' in source.info)
+
+            image = source.convert('RGBA' if has_alpha else 'RGB')
+
+    except OSError as e:
+        print(f'Warning: Could not read image {image_path}: {e}')
+        image = None
+
+    if image is not None:
+
+        for width in sorted({min(width, image.width) for width in widths}):
+
+            height = max(1, round(image.height * width / image.width))
+
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+            for variant_format in formats:
+
+                if variant_format == FALLBACK_FORMAT and has_alpha:
+                    continue
+
+                # The source name is kept whole, so photo.png and photo.jpg never share a variant name
+                variant_path = os.path.join(directory, f'{name}.{width}w.{variant_format}')
+
+                resized.save(variant_path, PILLOW_FORMATS[variant_format], quality = quality)
+
+                variants.append([variant_path, width, variant_format])
+
+    # Written last, so an interrupted encode is never mistaken for a finished one
+    with open(os.path.join(directory, 'variants.json'), 'w') as listing_file:
+        json.dump(variants, listing_file)
+
+    return variants
+
+def build_variants(image_paths, widths = VARIANT_WIDTHS, quality = VARIANT_QUALITY, max_workers = None, directory = VARIANT_DIRECTORY):
+    '''
+    Make the responsive variants of a batch of images, encoding the ones not already cached in a process pool.
+
+    Returns a dict of image path -> list of [variant path, width, format]. Images that could not be encoded
+    (or every image, without Pillow) are left out, and should be published as they are
+    '''
+
+    formats = available_formats()
+
+    if not formats:
+        return {}
+
+    results = {}
+    pending = {}
+
+    for image_path in dict.fromkeys(image_paths):
+
+        if not is_image(image_path) or not os.path.isfile(image_path):
+            continue
+
+        variant_directory = os.path.join(directory, variant_key(cached_hash_file(image_path), widths, formats, quality))
+
+        variants = cached_variants(variant_directory)
+
+        if variants is not None:
+            results[image_path] = variants
+        else:
+            pending[image_path] = variant_directory
+
+    if not pending:
+        return results
+
+    print(f'Encoding variants of {len(pending)} image(s)')
+
+    with ProcessPoolExecutor(max_workers = max_workers) as pool:
+
+        futures = {image_path: pool.submit(encode_variants, image_path, variant_directory, widths, formats, quality) for image_path, variant_directory in pending.items()}
+
+        for image_path, future in futures.items():
+
+            try:
+                results[image_path] = future.result()
+            except Exception as e:
+                print(f'Warning: Could not encode variants of {image_path}: {e}')
+
+    return results
+
+def find_ffmpeg():
+    '''Path to an ffmpeg executable, or None if there is none available'''
+
+    path = shutil.which('ffmpeg')
+
+    if path is not None:
+        return path
+
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return None
+
+def extract_poster(ffmpeg: str, video_path: str, poster_path: str):
+    '''Write one frame of the video as a jpeg. Returns True if a frame was written'''
+
+    # Seeking before the input is fast, but past the end of a short clip gives no frame, so fall back to the first
+    for seek in (POSTER_TIME, 0):
+
+        command = [
+            ffmpeg, '-v', 'error', '-y',
+            '-ss', str(seek), '-i', video_path,
+            '-frames:v', '1',
+            '-vf', f'scale=min({POSTER_MAX_WIDTH}\\,iw):-2',
+            '-q:v', '3',
+            poster_path,
+        ]
+
+        try:
+            subprocess.run(command, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, timeout = POSTER_TIMEOUT, check = True)
+        except subprocess.CalledProcessError as e:
+            print(f'Warning: Could not extract a poster from {video_path}: {e.stderr.decode(errors = "replace").strip()}')
+            return False
+        except subprocess.TimeoutExpired:
+            print(f'Warning: Timed out extracting a poster from {video_path}')
+            return False
+
+        if os.path.exists(poster_path) and os.path.getsize(poster_path) > 0:
+            return True
+
+    return False
+
+def build_posters(video_paths, max_workers = None, directory = POSTER_DIRECTORY):
+    '''
+    Extract a poster frame for each video in a batch, reusing posters already cached for unchanged videos.
+
+    Returns a dict of video path -> poster path. Videos without a poster (or every video, without ffmpeg) are left out
+    '''
+
+    video_paths = [path for path in dict.fromkeys(video_paths) if is_video(path) and os.path.isfile(path)]
+
+    if not video_paths:
+        return {}
+
+    results = {}
+    pending = {}
+
+    for video_path in video_paths:
+
+        poster_directory = os.path.join(directory, cached_hash_file(video_path)[:32])
+
+        # The source name is kept whole, so clip.mp4 and clip.mov never share a poster name
+        poster_path = os.path.join(poster_directory, os.path.basename(video_path) + '.poster.jpg')
+
+        if os.path.exists(poster_path):
+            results[video_path] = poster_path
+        elif not os.path.exists(poster_path + '.failed'):
+            pending[video_path] = poster_path
+
+    if not pending:
+        return results
+
+    ffmpeg = find_ffmpeg()
+
+    if ffmpeg is None:
+        print(f'Warning: ffmpeg not found, publishing {len(pending)} video(s) without a poster')
+        return results
+
+    print(f'Extracting posters of {len(pending)} video(s)')
+
+    def extract(item):
+        video_path, poster_path = item
+
+        os.makedirs(os.path.dirname(poster_path), exist_ok = True)
+
+        # Extracted beside its final name, so an interrupted run never leaves a partial poster in the cache
+        temp_path = poster_path[:-len('.jpg')] + '.tmp.jpg'
+
+        if not extract_poster(ffmpeg, video_path, temp_path):
+            # Remembered, so an unreadable video is not retried on every compile
+            open(poster_path + '.failed', 'w').close()
+            return video_path, None
+
+        os.replace(temp_path, poster_path)
+
+        return video_path, poster_path
+
+    # ffmpeg does the work in its own process, threads are enough to run several at once
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        for video_path, poster_path in pool.map(extract, pending.items()):
+            if poster_path is not None:
+                results[video_path] = poster_path
+
+    return results
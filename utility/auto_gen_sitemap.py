@@ -1,23 +1,209 @@
+import io
 import os
-import xml.etree.ElementTree as ET
-from urllib.parse import urljoin
+import gzip
+import fnmatch
+import argparse
+import filecmp
+import tempfile
+from datetime import datetime, timezone
+from itertools import chain, islice
+from urllib.parse import urljoin, quote
+from xml.sax.saxutils import escape
+
+from project_handler import ProjectHandler, INDEX_NAME, INDEX_KEY
 
 BASE_URL = "https://logan-boehm.com/"
 
-def create_sitemap(directory, output_file="sitemap.xml"):
-    urlset = ET.Element("urlset", xmlns="http://www.sitemaps.org/schemas/sitemap/0.9")
-    
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".html"):  # Only include HTML files
-                file_path = os.path.relpath(os.path.join(root, file), directory)
-                url = urljoin(BASE_URL, file_path.replace("\\", "/"))
-                url_element = ET.SubElement(urlset, "url")
-                loc_element = ET.SubElement(url_element, "loc")
-                loc_element.text = url
-
-    tree = ET.ElementTree(urlset)
-    tree.write(os.path.join(directory, output_file), encoding="utf-8", xml_declaration=True)
+SITEMAP_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+# Most urls a single sitemap file may list
+MAX_URLS_PER_SHARD = 50000
+
+SHARD_NAME = "sitemap-{}.xml.gz"
+SHARD_PATTERN = "sitemap-*.xml.gz"
+
+# Matched against the name, and the path from the site root, of every file and directory. Ignored directories are never entered
+IGNORE_PATTERNS = (".*", "__pycache__", "temp", "utility", "404error.html", "projects/project.html")
+
+PROJECT_PAGE = "projects/project.html?project="
+
+def format_lastmod(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+def ignored(name, relative_path, patterns):
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+def walk_pages(directory, patterns = IGNORE_PATTERNS, relative = ""):
+    """Yield (path, lastmod) of every html page under directory, in a stable order, with lastmod from the file's mtime"""
+
+    with os.scandir(os.path.join(directory, relative)) as scan:
+        entries = sorted(scan, key = lambda entry: entry.name)
+
+    for entry in entries:
+
+        relative_path = f"{relative}/{entry.name}" if relative else entry.name
+
+        if ignored(entry.name, relative_path, patterns):
+            continue
+
+        if entry.is_dir(follow_symlinks = False):
+            yield from walk_pages(directory, patterns, relative_path)
+        elif entry.name.endswith(".html"):
+            yield quote(relative_path), format_lastmod(entry.stat().st_mtime)
+
+def remote_projects(s3_wrapper):
+    """Yield (path, lastmod) of every published project page, from the bucket listing"""
+
+    for summary in s3_wrapper.iter_objects("projects/"):
+
+        key = summary["Key"]
+
+        # Icons and project bodies sit in folders below the projects
+        if key == INDEX_KEY or not key.endswith(".json") or "/" in key.partition("projects/")[2]:
+            continue
+
+        yield PROJECT_PAGE + quote(key.partition("projects/")[2], safe = ""), format_lastmod(summary["LastModified"].timestamp())
+
+def local_projects(directory):
+    """Yield (path, lastmod) of every project page with a json in the site's projects directory"""
+
+    with os.scandir(os.path.join(directory, "projects")) as scan:
+        entries = sorted(scan, key = lambda entry: entry.name)
+
+    for entry in entries:
+        if entry.name.endswith(".json") and entry.name != INDEX_NAME and entry.is_file():
+            yield PROJECT_PAGE + quote(entry.name, safe = ""), format_lastmod(entry.stat().st_mtime)
+
+def write_urlset(output, entries):
+
+    output.write(f'<?xml version="1.0" encoding="utf-8"?>\n<urlset xmlns="{SITEMAP_NAMESPACE}">\n')
+
+    for path, lastmod in entries:
+        output.write(f"<url><loc>{escape(urljoin(BASE_URL, path))}</loc><lastmod>{lastmod}</lastmod></url>\n")
+
+    output.write("</urlset>\n")
+
+def write_index(output, shards):
+
+    output.write(f'<?xml version="1.0" encoding="utf-8"?>\n<sitemapindex xmlns="{SITEMAP_NAMESPACE}">\n')
+
+    for name, lastmod in shards:
+        output.write(f"<sitemap><loc>{escape(urljoin(BASE_URL, name))}</loc><lastmod>{lastmod}</lastmod></sitemap>\n")
+
+    output.write("</sitemapindex>\n")
+
+def write_if_changed(path, write, compress = False):
+    """
+    Write a file through write(text_file), only replacing path if the contents differ.
+
+    Returns whether path was rewritten. Gzip output is reproducible (no name or mtime in the header), so unchanged contents compare equal
+    """
+
+    descriptor, temp_path = tempfile.mkstemp(dir = os.path.dirname(path) or ".", suffix = ".tmp")
+
+    try:
+        with open(descriptor, "wb") as raw_file:
+
+            if compress:
+                with gzip.GzipFile(fileobj = raw_file, mode = "wb", mtime = 0) as compressed, io.TextIOWrapper(compressed, encoding = "utf-8") as text_file:
+                    write(text_file)
+            else:
+                with io.TextIOWrapper(raw_file, encoding = "utf-8") as text_file:
+                    write(text_file)
+
+        if os.path.exists(path) and filecmp.cmp(temp_path, path, shallow = False):
+            os.remove(temp_path)
+            return False
+
+        # mkstemp files are private, the sitemap is served to everyone
+        os.chmod(temp_path, 0o644)
+
+        os.replace(temp_path, path)
+
+        return True
+
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def remove_stale_shards(directory, shard_count):
+
+    for name in os.listdir(directory):
+
+        if not fnmatch.fnmatch(name, SHARD_PATTERN):
+            continue
+
+        number = name[len("sitemap-"):-len(".xml.gz")]
+
+        if not number.isdigit() or int(number) > shard_count:
+            os.remove(os.path.join(directory, name))
+
+def create_sitemap(directory, output_file = "sitemap.xml", projects = (), patterns = IGNORE_PATTERNS, max_urls = MAX_URLS_PER_SHARD):
+    """
+    Write the sitemap of every html page under directory, followed by the (path, lastmod) project pages given.
+
+    Up to max_urls, output_file is a single sitemap. Past that, the urls are split into gzipped shards beside it,
+    and output_file becomes their sitemap index. Urls are streamed out a shard at a time,
+    and a file whose contents have not changed is left untouched
+    """
+
+    entries = chain(walk_pages(directory, patterns), projects)
+
+    output_path = os.path.join(directory, output_file)
+
+    shard = list(islice(entries, max_urls))
+
+    following = next(entries, None)
+
+    url_count = len(shard)
+
+    if following is None:
+        rewritten = [output_file] if write_if_changed(output_path, lambda output: write_urlset(output, shard)) else []
+
+        remove_stale_shards(directory, 0)
+
+        print(f"Sitemap: {url_count} url(s), {'rewritten' if rewritten else 'unchanged'}")
+
+        return
+
+    entries = chain([following], entries)
+
+    shards = []
+    rewritten = []
+
+    while shard:
+
+        name = SHARD_NAME.format(len(shards) + 1)
+
+        if write_if_changed(os.path.join(directory, name), lambda output: write_urlset(output, shard), compress = True):
+            rewritten.append(name)
+
+        shards.append((name, max(lastmod for _, lastmod in shard)))
+
+        shard = list(islice(entries, max_urls))
+
+        url_count += len(shard)
+
+    if write_if_changed(output_path, lambda output: write_index(output, shards)):
+        rewritten.append(output_file)
+
+    remove_stale_shards(directory, len(shards))
+
+    print(f"Sitemap: {url_count} url(s) in {len(shards)} shard(s), rewrote {', '.join(rewritten) or 'nothing'}")
 
 if __name__ == "__main__":
-    create_sitemap(".")  # Adjust to your website's build/output directory
+
+    parser = argparse.ArgumentParser(description = "Write the sitemap of the site, project pages included")
+    parser.add_argument("directory", nargs = "?", default = ".", help = "The site's build/output directory")
+    parser.add_argument("--projects", choices = ("remote", "local", "none"), default = "remote", help = "List project pages from the bucket, from the site's projects directory, or not at all")
+
+    args = parser.parse_args()
+
+    if args.projects == "remote":
+        projects = remote_projects(ProjectHandler().client)
+    elif args.projects == "local":
+        projects = local_projects(args.directory)
+    else:
+        projects = ()
+
+    create_sitemap(args.directory, projects = projects)
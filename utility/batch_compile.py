@@ -0,0 +1,213 @@
+'''
+Headless compile of every project in a source directory, spread across all cores.
+
+Each project is a folder named after the project, holding project.qhtml and meta.json:
+
+    {
+        "short_title": "...",
+        "long_title": "...",
+        "image_path": "...",
+        "description": "...",
+        "techs": ["<svg ...>"],
+        "tags": ["..."],
+        "github_link": "...",
+        "href_link": "..."
+    }
+
+Paths (the image, and the content flags inside the qhtml) resolve from the working directory, same as gui.py
+
+Usage: python batch_compile.py <source directory> [--remote] [--workers N] [--incremental] [--summary summary.json] [--trace trace.json] [--hashed-keys]
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from project_compiler import LinkCompiler, CompileCache, compile
+from project_handler import ProjectHandler, BUCKET_NAME, ensure_proj_formatting
+from s3_utils import S3Wrapper
+import tracing
+
+QHTML_NAME = 'project.qhtml'
+META_NAME = 'meta.json'
+
+COMPILE_CACHE_DIRECTORY = '.cache/compile'
+
+# One compiler, and for remote compiles one handler to publish with, per worker process, built by init_worker
+worker_link_compiler = None
+worker_handler = None
+
+def init_worker(bucket_name: str, profile: str, local: bool, trace: bool = False, hashed_keys: bool = False):
+
+    global worker_link_compiler, worker_handler
+
+    if trace:
+        tracing.start_trace()
+
+    # Local compiles never touch S3, so no client (or credentials) are needed.
+    # Workers only read the upload manifest, their changes to it go back to the parent, the one process that writes it.
+    # Nor do they cache listings, the parent drops its cached listings of whatever they uploaded
+    client = None if local else S3Wrapper(bucket_name, profile_name=profile, listing_cache_path = None, defer_manifest = True)
+
+    # The pool already runs a project per core. Image encoding and migrations stay on one process / thread per worker,
+    # rather than every worker starting a pool of its own
+    worker_link_compiler = LinkCompiler(client, bucket_name, max_workers = 1, hashed_keys = hashed_keys)
+
+    worker_handler = None if local else ProjectHandler(bucket_name, profile, client = client)
+
+def find_projects(source_directory: str):
+
+    return sorted(entry.name for entry in os.scandir(source_directory) if entry.is_dir() and os.path.exists(os.path.join(entry.path, QHTML_NAME)))
+
+def compile_project(source_directory: str, project_name: str, output_directory: str, local: bool, incremental: bool):
+
+    start = time.perf_counter()
+
+    project_directory = os.path.join(source_directory, project_name)
+
+    with open(os.path.join(project_directory, META_NAME)) as meta_file:
+        meta = json.load(meta_file)
+
+    json_name = ensure_proj_formatting(project_name)
+
+    project_json_path = os.path.join(output_directory, json_name)
+
+    cache = CompileCache(os.path.join(COMPILE_CACHE_DIRECTORY, json_name)) if incremental else None
+
+    # Swapped for icon references by the compile
+    techs = list(meta.get('techs', []))
+
+    written = compile(
+        worker_link_compiler,
+        project_json_path,
+        meta.get('short_title', ''),
+        meta.get('long_title', ''),
+        meta.get('image_path', ''),
+        meta.get('description', ''),
+        techs,
+        os.path.join(project_directory, QHTML_NAME),
+        list(meta.get('tags', [])),
+        meta.get('github_link', ''),
+        meta.get('href_link', ''),
+        local,
+        cache = cache
+    )
+
+    compile_seconds = time.perf_counter() - start
+
+    if not local:
+        # The manifest and the index are left to the parent, once every project is in
+        worker_handler.publish_project(json_name, output_directory)
+
+    return {
+        'project': project_name,
+        'status': 'ok',
+        'written': written,
+        'compile_seconds': compile_seconds,
+        'total_seconds': time.perf_counter() - start,
+        # Spans recorded in this worker, handed back for the parent's trace
+        'trace_events': tracing.drain_events(),
+        # Uploads recorded in this worker, for the parent's manifest
+        'manifest_changes': [] if local else worker_link_compiler.client.take_manifest_changes(),
+    }
+
+def batch_compile(source_directory: str, output_directory: str = '../projects', local: bool = True, workers: int = None, incremental: bool = False, bucket_name: str = BUCKET_NAME, profile: str = 'personal', hashed_keys: bool = False):
+    '''Compile every project in the source directory. If tracing is on, the workers' spans are merged into it'''
+
+    projects = find_projects(source_directory)
+
+    os.makedirs(output_directory, exist_ok = True)
+
+    results = []
+
+    manifest_changes = []
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = init_worker, initargs = (bucket_name, profile, local, tracing.tracing_enabled(), hashed_keys)) as pool:
+
+        futures = [(project_name, pool.submit(compile_project, source_directory, project_name, output_directory, local, incremental)) for project_name in projects]
+
+        for project_name, future in futures:
+
+            try:
+                result = future.result()
+            except Exception as e:
+                results.append({'project': project_name, 'status': 'error', 'error': f'{type(e).__name__}: {e}'})
+                continue
+
+            tracing.merge_events(result.pop('trace_events'))
+
+            manifest_changes.extend(result.pop('manifest_changes'))
+
+            results.append(result)
+
+    if not local and any(result['status'] == 'ok' for result in results):
+        # Merge every worker's uploads into the manifest, mirror it, and rebuild the index once
+        handler = ProjectHandler(bucket_name, profile)
+
+        handler.client.merge_manifest_changes(manifest_changes)
+
+        for s3_key in dict.fromkeys(s3_key for _, s3_key, _ in manifest_changes):
+            handler.client.invalidate_listing(s3_key)
+
+        handler.client.push_manifest()
+        handler.build_index()
+
+    return results
+
+def print_summary(results, elapsed: float):
+
+    print()
+    print(f'{"Project":<30} {"Status":<8} {"Written":<8} {"Seconds":>8}')
+    print('-' * 57)
+
+    for result in results:
+        if result['status'] == 'ok':
+            print(f'{result["project"]:<30} {"ok":<8} {str(result["written"]):<8} {result["total_seconds"]:>8.2f}')
+        else:
+            print(f'{result["project"]:<30} {"error":<8} {"":<8} {"":>8}')
+            print(f'    {result["error"]}')
+
+    print('-' * 57)
+
+    failed = sum(result['status'] != 'ok' for result in results)
+
+    print(f'{len(results) - failed} compiled, {failed} failed, in {elapsed:.2f}s')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Compile every project in a source directory')
+    parser.add_argument('source_directory')
+    parser.add_argument('--output', default = '../projects', help = 'Directory to write compiled project json to')
+    parser.add_argument('--remote', action = 'store_true', help = 'Upload assets and compiled projects to S3')
+    parser.add_argument('--workers', type = int, default = None, help = 'Worker processes (default: one per core)')
+    parser.add_argument('--incremental', action = 'store_true', help = 'Reuse unchanged fragments from the previous run')
+    parser.add_argument('--summary', default = None, help = 'Write the per-project summary to this json file')
+    parser.add_argument('--bucket', default = BUCKET_NAME)
+    parser.add_argument('--profile', default = 'personal')
+    parser.add_argument('--hashed-keys', action = 'store_true', help = 'Upload assets under content hashed keys, cached forever by browsers')
+    parser.add_argument('--trace', default = None, help = 'Write a timing trace of the run to this file (.json for Chrome tracing, .jsonl for json lines)')
+
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        tracing.start_trace()
+
+    start = time.perf_counter()
+
+    results = batch_compile(args.source_directory, args.output, not args.remote, args.workers, args.incremental, args.bucket, args.profile, args.hashed_keys)
+
+    elapsed = time.perf_counter() - start
+
+    print_summary(results, elapsed)
+
+    if args.trace is not None:
+        tracing.stop_trace(args.trace)
+
+    if args.summary is not None:
+        with open(args.summary, 'w') as summary_file:
+            json.dump({'elapsed_seconds': elapsed, 'projects': results}, summary_file, indent = 4)
+
+    sys.exit(any(result['status'] != 'ok' for result in results))
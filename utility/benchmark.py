@@ -0,0 +1,239 @@
+'''
+Benchmarks for the compiler and string helpers, over synthetic projects.
+
+Every case runs against a fake S3 client inside a scratch directory, so nothing touches the network or ../projects.
+Results are written as json, and a previous run can be passed to --compare to see the change per case.
+
+Usage: python benchmark.py [--quick] [--repeats N] [--output results.json] [--compare previous.json]
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import htmlmin
+
+from project_compiler import LinkCompiler, CONTENT_FLAG_STRING, compile, resize_svg
+from string_helpers import quasi_find, optional_block_targeting
+from s3_utils import local_paths
+
+BUCKET_NAME = 'benchmark-bucket'
+
+ASSET_COUNTS = (10, 100, 1000)
+TEXT_SIZES = (10 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+QUICK_ASSET_COUNTS = (10, 100)
+QUICK_TEXT_SIZES = (10 * 1024, 1024 * 1024)
+
+ASSET_TYPES = ('png', 'mp4', 'pdf', 'jpg', 'mov')
+
+FILLER = '<p>Lorem ipsum dolor sit amet, consectetur   adipiscing elit, sed do eiusmod tempor.</p>\n'
+
+SAMPLE_SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="256" height="210" viewBox="0 0 256 210"><path d="' + 'M80.455 208.842H60.45v-18.359h19.69z' * 100 + '"/></svg>'
+
+class FakeS3Client:
+    '''Stands in for S3Wrapper, answering instantly without touching the network'''
+
+    def __init__(self, bucket_name = BUCKET_NAME, region = 'us-east-2'):
+        self.url_base = f'https://{bucket_name}.s3.{region}.amazonaws.com/'
+
+    def upload_file(self, file_path, s3_key, progress_callback = None, cache_control = None):
+        return self.url_base + s3_key.replace('\\', '/')
+
+    def download_url_to_directory(self, url, directory):
+        return os.path.join(directory, os.path.basename(url))
+
+    def download_urls_to_directory(self, urls, directory, max_workers = None):
+        return local_paths(urls, directory)
+
+def make_assets(directory, asset_count):
+
+    paths = []
+
+    for index in range(asset_count):
+        path = os.path.join(directory, f'asset_{index}.{ASSET_TYPES[index % len(ASSET_TYPES)]}')
+
+        with open(path, 'wb') as asset_file:
+            asset_file.write(b'\0')
+
+        paths.append(path)
+
+    return paths
+
+def make_qhtml(asset_paths, text_size):
+    '''Filler text of roughly text_size bytes, with a content flag for every asset spread through it'''
+
+    filler_count = max(1, text_size // len(FILLER))
+
+    per_flag = max(1, filler_count // max(1, len(asset_paths)))
+
+    parts = []
+
+    for index, path in enumerate(asset_paths):
+        parts.append(FILLER * per_flag)
+        parts.append(f'{CONTENT_FLAG_STRING}{path}\n')
+
+    parts.append(FILLER * max(0, filler_count - per_flag * len(asset_paths)))
+
+    return ''.join(parts)
+
+def measure(function, repeats):
+
+    timings = []
+
+    for _ in range(repeats):
+        # The compiler narrates every migration, keep that out of the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+    return timings
+
+def run_case(results, name, function, repeats, **parameters):
+
+    timings = measure(function, repeats)
+
+    result = {
+        'name': name,
+        **parameters,
+        'repeats': repeats,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+    }
+
+    results.append(result)
+
+    described = ' '.join(f'{key}={value}' for key, value in parameters.items())
+
+    print(f'{name:<28} {described:<36} min {result["min_seconds"]:.4f}s  median {result["median_seconds"]:.4f}s', flush=True)
+
+def case_key(result):
+    return (result['name'],) + tuple(sorted((key, value) for key, value in result.items() if key not in ('name', 'repeats', 'min_seconds', 'median_seconds')))
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(asset_counts, text_sizes, repeats):
+
+    results = []
+
+    link_compiler = LinkCompiler(FakeS3Client(), BUCKET_NAME)
+
+    with tempfile.TemporaryDirectory() as scratch:
+
+        # The compiler works relative to utility/, with ../projects beside it
+        working_directory = os.path.join(scratch, 'utility')
+        asset_directory = os.path.join(scratch, 'assets')
+
+        os.makedirs(working_directory)
+        os.makedirs(os.path.join(scratch, 'projects', 'temp'))
+        os.makedirs(asset_directory)
+
+        previous_directory = os.getcwd()
+        os.chdir(working_directory)
+
+        try:
+            run_case(results, 'resize_svg', lambda: [resize_svg(SAMPLE_SVG) for _ in range(1000)], repeats, calls=1000)
+
+            for text_size in text_sizes:
+
+                text = make_qhtml([], text_size)
+
+                # Targets at the far ends, so each search covers the whole text
+                far_text = '<img src="start">' + text + '</video>'
+
+                run_case(results, 'quasi_find', lambda: quasi_find(far_text, '</video>', 0), repeats, text_bytes=text_size)
+                run_case(results, 'optional_block_targeting', lambda: optional_block_targeting(far_text, len(far_text) - 1, link_compiler.HTML_KEYS), repeats, text_bytes=text_size)
+                run_case(results, 'htmlmin.minify', lambda: htmlmin.minify(text, remove_empty_space=True, remove_optional_attribute_quotes=False), repeats, text_bytes=text_size)
+
+            for asset_count in asset_counts:
+
+                asset_paths = make_assets(asset_directory, asset_count)
+
+                for text_size in text_sizes:
+
+                    qhtml = make_qhtml(asset_paths, text_size)
+
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        compiled = link_compiler.compile_forward(qhtml, 'benchmark', cloud = True)
+
+                    run_case(results, 'compile_forward', lambda: link_compiler.compile_forward(qhtml, 'benchmark', cloud = True), repeats, assets=asset_count, text_bytes=text_size)
+                    run_case(results, 'compile_backward', lambda: link_compiler.compile_backward(compiled), repeats, assets=asset_count, text_bytes=text_size)
+
+                    qhtml_path = os.path.join(scratch, 'benchmark.qhtml')
+
+                    with open(qhtml_path, 'w') as qhtml_file:
+                        qhtml_file.write(qhtml)
+
+                    def full_compile():
+                        compile(link_compiler, os.path.join(scratch, 'projects', 'benchmark.json'), 'Short', 'Long', asset_paths[0], 'Description', [SAMPLE_SVG] * 5, qhtml_path, ['Tag'], '', '', local = False)
+
+                    run_case(results, 'compile', full_compile, repeats, assets=asset_count, text_bytes=text_size)
+        finally:
+            os.chdir(previous_directory)
+
+    return results
+
+def compare(results, previous_path):
+
+    with open(previous_path) as previous_file:
+        previous = {case_key(result): result for result in json.load(previous_file)['results']}
+
+    print()
+    print(f'Compared with {previous_path} (ratio of min times, below 1 is faster)')
+
+    for result in results:
+
+        old = previous.get(case_key(result))
+
+        if old is None or old['min_seconds'] == 0:
+            continue
+
+        ratio = result['min_seconds'] / old['min_seconds']
+
+        described = ' '.join(f'{key}={value}' for key, value in case_key(result)[1:])
+
+        print(f'{result["name"]:<28} {described:<36} {ratio:.2f}x')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the compiler and string helpers')
+    parser.add_argument('--quick', action = 'store_true', help = 'Skip the largest projects')
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--output', default = None, help = 'Write results to this json file')
+    parser.add_argument('--compare', default = None, help = 'A previous results file to compare against')
+
+    args = parser.parse_args()
+
+    asset_counts, text_sizes = (QUICK_ASSET_COUNTS, QUICK_TEXT_SIZES) if args.quick else (ASSET_COUNTS, TEXT_SIZES)
+
+    results = run_benchmarks(asset_counts, text_sizes, args.repeats)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent = 4)
+
+    if args.compare is not None:
+        compare(results, args.compare)
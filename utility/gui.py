@@ -1,27 +1,43 @@
 import sys
+
+# First, so --profile-startup sees every import after it
+import startup_profile
+startup_profile.enable_from_arguments()
+
 import os
 import json
 import shutil
-import time
 import threading
-import http.server
-import socketserver
-import time
-from functools import partial
+import importlib
 from typing import List
-from PyQt5.QtWidgets import QApplication, QVBoxLayout, QWidget, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, QFileDialog
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import QTimer, QFileSystemWatcher, QUrl
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtWidgets import QApplication, QVBoxLayout, QWidget, QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, QFileDialog, QProgressBar
+from PyQt5.QtCore import QTimer, QFileSystemWatcher, QUrl, pyqtSignal
 
-from project_compiler import compile
+from project_compiler import compile, CompileCache
 
 from project_handler import ProjectHandler, ensure_proj_formatting
 
+from project_documents import load_project_text
+
+from preview_server import start_preview_server
+
+from tracing import trace_from_environment
+
+# Cheap to build, S3 (and boto3) are only brought in once a project is listed, pulled or uploaded
 p_hand = ProjectHandler()
 
+# Slow to import, and only needed by the window. Imported in the background while the console prompts run
+WEB_ENGINE_MODULE = 'PyQt5.QtWebEngineWidgets'
+
 QHTML_LOCATION = '../projects/proj.html'
 PORT = 8000
 
+# Started in __main__, pushes reload events to the preview page
+preview_server = None
+
+REFRESH_DEBOUNCE_MS = 300
+
 def get_image_link(img_html: str):
     img_html = img_html.replace('"', "'").replace(' ', '')
 
@@ -33,23 +49,35 @@ def get_image_link(img_html: str):
 
     return img_html[a: b]
 
-def start_server():
-    # Create a handler that serves from the parent directory
-    handler = partial(http.server.SimpleHTTPRequestHandler, directory="../")
+class MainWindow(QWidget):
 
-    with socketserver.TCPServer(("", PORT), handler) as httpd:
-        print(f"Serving ../ at http://localhost:{PORT}")
-        try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            pass
-        finally:
-            print("Server stopped.")
+    # Emitted from the compile thread, delivered on the UI thread. Carries whether the json was rewritten
+    compile_finished = pyqtSignal(bool)
+    upload_finished = pyqtSignal()
+
+    # Emitted from the upload threads with (file path, bytes sent, total bytes). Sizes go as objects, a Qt int overflows past 2 GB
+    upload_progress = pyqtSignal(str, object, object)
 
-class MainWindow(QWidget):
     def __init__(self, object_title:str):
         super().__init__()
 
+        # Live preview: edits restart the debounce timer, which compiles on a single worker thread
+        self.compile_executor = ThreadPoolExecutor(max_workers = 1)
+        self.compile_running = False
+        self.compile_pending = False
+
+        self.compile_finished.connect(self.on_compile_finished)
+        self.upload_finished.connect(self.on_upload_finished)
+        self.upload_progress.connect(self.on_upload_progress)
+
+        # Only uploads report progress, previews are compiled locally
+        p_hand.client.progress_callback = self.upload_progress.emit
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(REFRESH_DEBOUNCE_MS)
+        self.refresh_timer.timeout.connect(self.refresh_webpage)
+
         self.object_title = object_title
 
         if not self.object_title.endswith('.json'):
@@ -62,6 +90,11 @@ class MainWindow(QWidget):
 
         self.qhtml_file = QHTML_LOCATION
 
+        self.compile_cache = CompileCache()
+
+        self.qhtml_watcher = QFileSystemWatcher([self.qhtml_file], self)
+        self.qhtml_watcher.fileChanged.connect(self.on_qhtml_changed)
+
         self.setWindowTitle("PyQt Application")
 
         try:
@@ -81,6 +114,7 @@ class MainWindow(QWidget):
         self.short_title_label = QLabel("Short Title:")
         self.short_title_input = QLineEdit()
         self.short_title_input.setText(json_dump.get('projectShortTitle', ''))
+        self.short_title_input.textChanged.connect(self.schedule_refresh)
         self.left_layout.addWidget(self.short_title_label)
         self.left_layout.addWidget(self.short_title_input)
 
@@ -88,6 +122,7 @@ class MainWindow(QWidget):
         self.long_title_label = QLabel("Long Title:")
         self.long_title_input = QLineEdit()
         self.long_title_input.setText(json_dump.get('projectLongTitle', ''))
+        self.long_title_input.textChanged.connect(self.schedule_refresh)
         self.left_layout.addWidget(self.long_title_label)
         self.left_layout.addWidget(self.long_title_input)
 
@@ -136,6 +171,7 @@ class MainWindow(QWidget):
         self.left_layout.addWidget(self.github_input)
 
         self.github_input.setText(json_dump.get('githubLink', ''))
+        self.github_input.textChanged.connect(self.schedule_refresh)
 
         # Href Link input
         self.href_label = QLabel("Force Href Link:")
@@ -144,6 +180,7 @@ class MainWindow(QWidget):
         self.left_layout.addWidget(self.href_input)
 
         self.href_input.setText(json_dump.get('forceHref', ''))
+        self.href_input.textChanged.connect(self.schedule_refresh)
 
         # Description input
         self.description_label = QLabel("Description:")
@@ -152,6 +189,7 @@ class MainWindow(QWidget):
         self.left_layout.addWidget(self.description_input)
 
         self.description_input.setPlainText(json_dump.get('projectDescription', '').replace("<p>", "").replace("</p>", ""))
+        self.description_input.textChanged.connect(self.schedule_refresh)
 
         self.refresh_button = QPushButton('Refresh!')
         self.refresh_button.clicked.connect(self.refresh_webpage)
@@ -161,10 +199,18 @@ class MainWindow(QWidget):
         self.upload_button.clicked.connect(self.upload_project)
         self.left_layout.addWidget(self.upload_button)
 
+        # Progress of the file being uploaded, shown while an upload runs
+        self.upload_progress_bar = QProgressBar()
+        self.upload_progress_bar.setRange(0, 100)
+        self.upload_progress_bar.setVisible(False)
+        self.left_layout.addWidget(self.upload_progress_bar)
+
         # Add the left layout to the main layout
         main_layout.addLayout(self.left_layout)
 
         # Right side layout (Web View)
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
+
         self.web_view = QWebEngineView()
         self.web_view.setUrl(QUrl(self.webpath))
         main_layout.addWidget(self.web_view)
@@ -173,35 +219,99 @@ class MainWindow(QWidget):
 
         self.setLayout(main_layout)
 
-        time.sleep(1)
         self.refresh_webpage()
 
+    def schedule_refresh(self, *args):
+        # Restarting the timer debounces bursts of edits into one compile
+        self.refresh_timer.start()
+
+    def on_qhtml_changed(self, path):
+
+        # Editors that save by replacing the file drop it from the watcher, so re-watch it
+        if path not in self.qhtml_watcher.files() and os.path.exists(path):
+            self.qhtml_watcher.addPath(path)
+
+        self.schedule_refresh()
+
+    def compile_arguments(self, local = True):
+        # Read every widget here, on the UI thread, the compile thread must not touch them
+
+        return (p_hand.link_compiler, self.filepath, self.short_title_input.text(), self.long_title_input.text(), self.selected_image_path, self.description_input.toPlainText(), self.get_techs(), self.qhtml_file, self.get_tags(), self.github_input.text(), self.href_input.text(), local)
+
     def refresh_webpage(self):
 
         # if os.path.exists('../projects/temp'):
         #     shutil.rmtree('../projects/temp') # Remove old files
 
-        compile(p_hand.link_compiler, self.filepath, self.short_title_input.text(), self.long_title_input.text(), self.selected_image_path, self.description_input.toPlainText(), self.get_techs(), self.qhtml_file, self.get_tags(), self.github_input.text(), self.href_input.text())
+        self.refresh_timer.stop()
+
+        if self.compile_running:
+            # Compile again once the current one lands
+            self.compile_pending = True
+            return
 
-        time.sleep(.5)
+        self.compile_running = True
 
-        self.web_view.setUrl(QUrl(f'{self.webpath}&nocache={time.time()}'))
+        self.compile_executor.submit(self.run_compile, self.compile_arguments())
 
-        time.sleep(.1)
+    def run_compile(self, arguments):
 
-        self.web_view.reload()
+        try:
+            written = compile(*arguments, cache = self.compile_cache)
+        except Exception as e:
+            print(f'Compile failed: {e}')
+            written = False
+
+        self.compile_finished.emit(written)
+
+    def on_compile_finished(self, written):
+
+        self.compile_running = False
+
+        if written and (preview_server is None or preview_server.notifier.notify(self.filepath) == 0):
+            # No preview page is listening for events yet, reload it directly
+            self.web_view.reload()
+
+        if self.compile_pending:
+            self.compile_pending = False
+            self.refresh_webpage()
     
     def upload_project(self):
 
-        compile(p_hand.link_compiler, self.filepath, self.short_title_input.text(), self.long_title_input.text(), self.selected_image_path, self.description_input.toPlainText(), self.get_techs(), self.qhtml_file, self.get_tags(), self.github_input.text(), self.href_input.text(), False)
+        self.upload_button.setEnabled(False)
+
+        self.compile_executor.submit(self.run_upload, self.compile_arguments(local = False))
+
+    def run_upload(self, arguments):
+
+        try:
+            compile(*arguments, cache = self.compile_cache)
+
+            p_hand.upload_project(self.object_title)
+        except Exception as e:
+            print(f'Upload failed: {e}')
+
+        self.upload_finished.emit()
+
+    def on_upload_progress(self, file_path, transferred, total):
+
+        self.upload_progress_bar.setVisible(True)
+        self.upload_progress_bar.setFormat(f'{os.path.basename(file_path)}: %p%')
+        self.upload_progress_bar.setValue(round(100 * transferred / total) if total else 100)
 
-        p_hand.client.upload_file(self.filepath, f'projects/{self.object_title}')
+    def on_upload_finished(self):
+
+        self.upload_button.setEnabled(True)
+
+        self.upload_progress_bar.setVisible(False)
 
         self.refresh_webpage()
 
     def post_image_filepath(self, path):
         self.image_file_label.setText(f"Selected: {os.path.basename(path)}")
         self.selected_image_path = os.path.join('../projects', path)
+
+        self.schedule_refresh()
     
     def post_tags(self, tags: List[str]):
 
@@ -236,6 +346,8 @@ class MainWindow(QWidget):
         if basetext is not None:
             tag_input.setText(basetext)
 
+        tag_input.textChanged.connect(self.schedule_refresh)
+
         tag_layout.addWidget(tag_input)
 
         # Add the tag entry to the container
@@ -250,6 +362,8 @@ class MainWindow(QWidget):
 
         # Remove the layout itself
         self.tag_container.removeItem(tag_layout)
+
+        self.schedule_refresh()
     
     def get_tags(self):
         # Retrieve all tags as a list
@@ -298,6 +412,8 @@ class MainWindow(QWidget):
         if basetext is not None:
             tech_input.setText(basetext)
 
+        tech_input.textChanged.connect(self.schedule_refresh)
+
         tech_layout.addWidget(tech_input)
 
         # Add the tech entry to the container
@@ -313,24 +429,34 @@ class MainWindow(QWidget):
         # Remove the layout itself
         self.tech_container.removeItem(tech_layout)
 
+        self.schedule_refresh()
+
 
 if __name__ == "__main__":
 
+    # TRACE_PATH=trace.json python gui.py records every compile and upload of the session
+    trace_from_environment()
+
     print("Init server...")
 
-    # Start HTTP server in background
-    server_thread = threading.Thread(target=start_server, daemon=True)
-    server_thread.start()
+    with startup_profile.stage('preview server'):
+        # Start HTTP server in background, it is bound (and so ready) once this returns
+        preview_server = start_preview_server('../', PORT)
 
-    time.sleep(3)
     print()
     print("Should be ready!")
 
+    # Must finish before the QApplication is made, which it is joined for below
+    web_engine_import = threading.Thread(target = importlib.import_module, args = (WEB_ENGINE_MODULE,), daemon = True)
+    web_engine_import.start()
+
     new_or_old = '.'
 
     while new_or_old not in ('new', 'old', '', 'continue'):
         print('New project, old, or continue editing?')
-        new_or_old = input('(old) ? ').lower()
+
+        with startup_profile.stage('prompt', waiting = True):
+            new_or_old = input('(old) ? ').lower()
 
     if new_or_old == '':
         new_or_old = 'old'
@@ -339,14 +465,19 @@ if __name__ == "__main__":
         print('All projects: ')
         print('-' * 20)
 
-        for item in p_hand.list_projects():
+        with startup_profile.stage('list projects'):
+            projects = p_hand.list_projects()
+
+        for item in projects:
             print('-', item.partition('.')[0])
 
         print('-' * 20)
 
-        name = ensure_proj_formatting(input('name: '))
+        with startup_profile.stage('prompt', waiting = True):
+            name = ensure_proj_formatting(input('name: '))
 
-        p_hand.pull_project(name)
+        with startup_profile.stage('pull project'):
+            p_hand.pull_project(name)
 
         print('Reverse compiling project...')
 
@@ -361,7 +492,7 @@ if __name__ == "__main__":
         with open(f'../projects/{name}', 'w') as json_file:
             json.dump(contents, json_file)
 
-        reverse_compilation = p_hand.link_compiler.compile_backward(contents['projectText'])
+        reverse_compilation = p_hand.link_compiler.compile_backward(load_project_text(f'../projects/{name}', contents))
 
         with open(QHTML_LOCATION, 'w') as f:
 
@@ -369,7 +500,8 @@ if __name__ == "__main__":
 
     elif new_or_old == 'new':
 
-        name = ensure_proj_formatting(input('name: '))
+        with startup_profile.stage('prompt', waiting = True):
+            name = ensure_proj_formatting(input('name: '))
 
         with open(os.path.join('../projects', name), 'w') as f:
             f.write('{}')
@@ -380,15 +512,24 @@ if __name__ == "__main__":
 
     else:
 
-        name = ensure_proj_formatting(input('name: '))
+        with startup_profile.stage('prompt', waiting = True):
+            name = ensure_proj_formatting(input('name: '))
 
     # name = 'cobot'
 
-    app = QApplication(sys.argv)
+    with startup_profile.stage('web engine import'):
+        web_engine_import.join()
+
+    with startup_profile.stage('application'):
+        app = QApplication(sys.argv)
+
+    with startup_profile.stage('window'):
+        # Create and show the main window
+        window = MainWindow(name)
+        window.resize(1800, 1200)
+        window.show()
 
-    # Create and show the main window
-    window = MainWindow(name)
-    window.resize(1800, 1200)
-    window.show()
+    # Runs once the event loop starts, with the window up and taking input
+    QTimer.singleShot(0, startup_profile.report)
 
     sys.exit(app.exec_())
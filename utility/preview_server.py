@@ -0,0 +1,256 @@
+import os
+import threading
+import http.server
+import email.utils
+from functools import partial
+
+EVENTS_PATH = '/__events'
+KEEPALIVE_SECONDS = 15
+COPY_CHUNK_SIZE = 64 * 1024
+
+class ReloadNotifier:
+    '''Wakes every connected preview page when a compiled project changes'''
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+        self.last_path = ''
+        self.listeners = 0
+
+    def notify(self, path = ''):
+        '''Announce a change. Returns how many pages were listening'''
+
+        with self.condition:
+            self.version += 1
+            self.last_path = path
+            self.condition.notify_all()
+
+            return self.listeners
+
+    def wait(self, version, timeout):
+        '''Block until the version moves past the given one, or the timeout passes'''
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+
+            return self.version, self.last_path
+
+class PreviewRequestHandler(http.server.SimpleHTTPRequestHandler):
+    '''
+    Static file handler with ETag / Last-Modified validation, single byte-range support (video seeking),
+    and a server-sent events stream at EVENTS_PATH that announces recompiles
+    '''
+
+    def do_GET(self):
+
+        if self.path.partition('?')[0] == EVENTS_PATH:
+            self.stream_events()
+            return
+
+        super().do_GET()
+
+    def end_headers(self):
+        # Always revalidate, the ETag turns unchanged files into cheap 304s
+        self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def send_head(self):
+
+        self.range_length = None
+
+        path = self.translate_path(self.path)
+
+        if os.path.isdir(path):
+            # Directory redirects and listings are left to the base handler
+            return super().send_head()
+
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, 'File not found')
+            return None
+
+        try:
+            fs = os.fstat(f.fileno())
+
+            etag = f'"{fs.st_mtime_ns:x}-{fs.st_size:x}"'
+            last_modified = self.date_time_string(fs.st_mtime)
+
+            if self.is_not_modified(etag, fs.st_mtime):
+                f.close()
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                return None
+
+            byte_range = self.requested_range(fs.st_size, etag)
+
+            if byte_range == 'invalid':
+                f.close()
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{fs.st_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+
+            if byte_range is None:
+                self.send_response(200)
+                self.send_header('Content-Length', str(fs.st_size))
+            else:
+                start, end = byte_range
+
+                f.seek(start)
+                self.range_length = end - start + 1
+
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{fs.st_size}')
+                self.send_header('Content-Length', str(self.range_length))
+
+            self.send_header('Content-Type', self.guess_type(path))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def is_not_modified(self, etag, mtime):
+
+        if_none_match = self.headers.get('If-None-Match')
+
+        if if_none_match is not None:
+            # If-None-Match wins over If-Modified-Since when both are sent
+            return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+
+        if if_modified_since is None:
+            return False
+
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+
+        return int(mtime) <= since
+
+    def requested_range(self, size, etag):
+        '''Parse a single "bytes=" range. Returns (start, end), None to send the whole file, or 'invalid' '''
+
+        range_header = self.headers.get('Range')
+
+        if range_header is None or not range_header.startswith('bytes='):
+            return None
+
+        if_range = self.headers.get('If-Range')
+
+        if if_range is not None and if_range.strip() != etag:
+            # File changed since the client's partial copy, send all of it
+            return None
+
+        spec = range_header[len('bytes='):].strip()
+
+        if ',' in spec:
+            # Multipart ranges are not worth supporting here, the full body is a valid answer
+            return None
+
+        start_text, _, end_text = spec.partition('-')
+
+        try:
+            if start_text == '':
+                # Suffix range, the last N bytes
+                suffix = int(end_text)
+
+                if suffix == 0:
+                    return 'invalid'
+
+                start, end = max(0, size - suffix), size - 1
+            else:
+                start = int(start_text)
+                end = int(end_text) if end_text else size - 1
+        except ValueError:
+            return None
+
+        if start >= size or start > end:
+            return 'invalid'
+
+        return start, min(end, size - 1)
+
+    def copyfile(self, source, outputfile):
+
+        if self.range_length is None:
+            super().copyfile(source, outputfile)
+            return
+
+        remaining = self.range_length
+
+        while remaining > 0:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+
+            if not chunk:
+                break
+
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+    def stream_events(self):
+
+        notifier: ReloadNotifier = self.server.notifier
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        with notifier.condition:
+            version = notifier.version
+            notifier.listeners += 1
+
+        try:
+            self.wfile.write(b'retry: 1000\n\n')
+            self.wfile.flush()
+
+            while True:
+                new_version, path = notifier.wait(version, KEEPALIVE_SECONDS)
+
+                if new_version == version:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    version = new_version
+                    self.wfile.write(f'event: reload\ndata: {path}\n\n'.encode())
+
+                self.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with notifier.condition:
+                notifier.listeners -= 1
+
+            self.close_connection = True
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+
+    # Open event streams must not keep the process alive
+    daemon_threads = True
+
+    def __init__(self, server_address, directory):
+
+        self.notifier = ReloadNotifier()
+
+        super().__init__(server_address, partial(PreviewRequestHandler, directory=directory))
+
+def start_preview_server(directory = '../', port = 8000):
+    '''Bind the preview server immediately, and serve it from a daemon thread. Returns the server once it accepts connections'''
+
+    server = PreviewServer(('', port), directory)
+
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    print(f"Serving {directory} at http://localhost:{port}")
+
+    return server
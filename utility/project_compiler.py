@@ -1,17 +1,43 @@
 from typing import List
 import json
 import os
+import hashlib
+import re
 import shutil
-import htmlmin
+from bisect import bisect_right
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-from string_helpers import parse_block, optional_block_targeting, isolate_block
+from string_helpers import quasi_pattern, quasi_find, quasi_end_of_string
 
-from s3_utils import S3Wrapper
+from s3_utils import S3Wrapper, hash_file, local_paths, IMMUTABLE_CACHE_CONTROL
+
+from asset_pipeline import build_variants, build_posters, MIME_TYPES, FALLBACK_FORMAT
+
+from tech_icons import register_icon, referenced_icons, icon_path
+
+from project_documents import write_project, bodies_present
+
+from tracing import span, traced, add_bytes, annotate
 
 # https://icon-sets.iconify.design
 
 CONTENT_FLAG_STRING = '!!Content!!:'
 
+MIGRATION_WORKERS = 8
+
+# Hex digits of the content hash in hashed asset keys, content/<project>/<hash>/<file name>
+KEY_HASH_LENGTH = 12
+
+# qhtml files past this size are compiled as a stream, in chunks of STREAM_CHUNK_SIZE characters
+STREAM_THRESHOLD = 8 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Layout width of images on the project page, lets the browser pick a variant before layout
+IMAGE_SIZES = '(max-width: 800px) 100vw, 800px'
+
+MINIFY_OPTIONS = {'remove_empty_space': True, 'remove_optional_attribute_quotes': False}
+
 def resize_svg(svg_text: str, size = 4):
 
     if not 'svg' in svg_text:
@@ -52,9 +78,113 @@ def attach_optional_field(text, object, field):
 
     object[field] = text
 
-def migrate(file_path: str, s3_wrapper: S3Wrapper, project_name: str, to_remote = False):
+def tokenize_content_flags(input_string: str):
+    '''
+    Scan a qhtml string once, yielding (start, end, parsed) for every content flag.
+
+    The span covers the flag and its path, up to (not including) the terminating newline
+    '''
+
+    flag_start = input_string.find(CONTENT_FLAG_STRING)
+
+    while flag_start != -1:
+
+        path_start = flag_start + len(CONTENT_FLAG_STRING)
+
+        flag_end = input_string.find('\n', path_start)
+
+        if flag_end == -1:
+            # Mirrors parse_block, which drops the final character when no newline follows
+            flag_end = max(path_start, len(input_string) - 1)
+
+        yield flag_start, flag_end, input_string[path_start: flag_end]
+
+        flag_start = input_string.find(CONTENT_FLAG_STRING, flag_end)
+
+def read_chunks(file_path: str, chunk_size = STREAM_CHUNK_SIZE):
+
+    with open(file_path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield chunk
+
+def split_content_flags(chunks):
+    '''
+    Streaming version of tokenize_content_flags, over an iterable of text chunks.
+
+    Yields (text, None) for plain text and (None, parsed) for every content flag, in document order.
+    Only the unfinished tail of the text is ever held, never the whole document
+    '''
+
+    buffer = ''
+
+    chunks = iter(chunks)
+
+    exhausted = False
+
+    while True:
+
+        flag_start = buffer.find(CONTENT_FLAG_STRING)
+
+        if flag_start == -1:
+
+            if exhausted:
+                if buffer:
+                    yield buffer, None
+                return
+
+            # Hold back enough to catch a flag split across chunks
+            keep = len(CONTENT_FLAG_STRING) - 1
+
+            if len(buffer) > keep:
+                yield buffer[:-keep], None
+                buffer = buffer[-keep:]
+
+            chunk = next(chunks, None)
+
+            if chunk is None:
+                exhausted = True
+            else:
+                buffer += chunk
+
+            continue
 
-    print('Migrating:', file_path, 'to', ['local', 'remote'][to_remote])
+        if flag_start > 0:
+            yield buffer[:flag_start], None
+            buffer = buffer[flag_start:]
+
+        path_start = len(CONTENT_FLAG_STRING)
+
+        flag_end = buffer.find('\n', path_start)
+
+        while flag_end == -1 and not exhausted:
+
+            chunk = next(chunks, None)
+
+            if chunk is None:
+                exhausted = True
+            else:
+                searched = len(buffer)
+                buffer += chunk
+                flag_end = buffer.find('\n', searched)
+
+        if flag_end == -1:
+            # Mirrors tokenize_content_flags, which drops the final character when no newline follows
+            flag_end = max(path_start, len(buffer) - 1)
+
+        yield None, buffer[path_start: flag_end]
+
+        buffer = buffer[flag_end:]
+
+@traced('compile.migrate')
+def migrate(file_path: str, s3_wrapper: S3Wrapper, project_name: str, to_remote = False, hashed_key = False):
+    '''
+    Copy a file to the local preview directory, or upload it to the bucket. Returns its new path or url
+
+    With hashed_key, the upload goes under a folder named by its content hash. The key then changes whenever
+    the content does, so the object is published as cacheable forever, and the file name itself is untouched
+    '''
+
+    print(f"Migrating: {file_path} to {['local', 'remote'][to_remote]}")
 
     if not os.path.exists(file_path):
         print(f'Warning: File does not exist: {file_path}')
@@ -65,6 +195,9 @@ def migrate(file_path: str, s3_wrapper: S3Wrapper, project_name: str, to_remote
         print('Note this is normal upon creating a new project, just assign the project image')
         return
 
+    annotate(file = file_path, remote = to_remote)
+    add_bytes(os.path.getsize(file_path))
+
     if not to_remote:
         # Transferring to local temp directory
 
@@ -87,22 +220,118 @@ def migrate(file_path: str, s3_wrapper: S3Wrapper, project_name: str, to_remote
 
         file_base = os.path.basename(file_path)
 
-        key = os.path.join('content', proj_base, file_base)
+        if not hashed_key:
+            return s3_wrapper.upload_file(file_path, os.path.join('content', proj_base, file_base))
+
+        key = os.path.join('content', proj_base, hash_file(file_path)[:KEY_HASH_LENGTH], file_base)
+
+        return s3_wrapper.upload_file(file_path, key, cache_control = IMMUTABLE_CACHE_CONTROL)
+
+class MigrationError(Exception):
+    '''Raised once every migration in a batch has finished, if any of them failed'''
+
+    def __init__(self, failures):
+
+        self.failures = failures
+
+        super().__init__(f'{len(failures)} file(s) failed to migrate:\n' + '\n'.join(f'{path}: {error}' for path, error in failures.items()))
+
+@traced('compile.migrate_all')
+def migrate_all(file_paths: List[str], s3_wrapper: S3Wrapper, project_name: str, to_remote = False, max_workers = MIGRATION_WORKERS, hashed_keys = False):
+    '''
+    Migrate a batch of files through a bounded thread pool.
+
+    Returns a dict of file path -> migrated path. Failures are collected, and raised together as a MigrationError
+    '''
+
+    unique_paths = list(dict.fromkeys(file_paths))
+
+    annotate(files = len(unique_paths), remote = to_remote)
+
+    migrated = {}
+    failures = {}
+
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+
+        futures = {path: pool.submit(migrate, path, s3_wrapper, project_name, to_remote, hashed_keys) for path in unique_paths}
+
+        for path, future in futures.items():
+
+            try:
+                new_path = future.result()
+            except Exception as e:
+                failures[path] = e
+                continue
+
+            if new_path is None:
+                failures[path] = 'File was not migrated'
+                continue
+
+            migrated[path] = new_path
+
+    if failures:
+        raise MigrationError(failures)
+
+    return migrated
+
+def render_picture(src: str, variants, quote = "'"):
+    '''
+    Html for an image with responsive variants, given its migrated path and a list of (migrated path, width, format).
 
-        return s3_wrapper.upload_file(file_path, key)
+    The original rides along as data-src, the first url of the element, which is what compile_backward restores
+    '''
+
+    q = quote
+
+    sources = []
+
+    for variant_format in dict.fromkeys(variant_format for _, _, variant_format in variants):
+
+        if variant_format == FALLBACK_FORMAT:
+            continue
+
+        srcset = ', '.join(f'{path} {width}w' for path, width, path_format in variants if path_format == variant_format)
+
+        sources.append(f'<source type={q}{MIME_TYPES[variant_format]}{q} srcset={q}{srcset}{q} sizes={q}{IMAGE_SIZES}{q}>')
+
+    fallback = ', '.join(f'{path} {width}w' for path, width, path_format in variants if path_format == FALLBACK_FORMAT)
+
+    fallback_attributes = f' srcset={q}{fallback}{q} sizes={q}{IMAGE_SIZES}{q}' if fallback else ''
+
+    return f'<picture data-src={q}{src}{q}>' + ''.join(sources) + f'<img src={q}{src}{q}{fallback_attributes} loading={q}lazy{q} decoding={q}async{q}></picture>'
+
+# Without a poster the browser needs the first frame, and so the video's metadata, to draw anything
+VIDEO_TAG = "<video controls preload='metadata'>"
+
+def render_video(template: str, src: str, poster: str):
+    '''Html for a video with a poster frame. Nothing of the video is fetched until it is played'''
+
+    # The video rides along as data-src, ahead of the poster, so compile_backward restores the video and not its poster
+    return template.replace(VIDEO_TAG, f"<video data-src='{src}' controls preload='none' poster='{poster}'>", 1)
 
 class LinkCompiler:
-    def __init__(self, s3_wrapper: 'S3Wrapper', bucket_name: str, region = 'us-east-2'):
+    def __init__(self, s3_wrapper: 'S3Wrapper', bucket_name: str, region = 'us-east-2', max_workers = MIGRATION_WORKERS, responsive_images = True, video_posters = True, hashed_keys = False):
 
         self.client = s3_wrapper
 
+        self.max_workers = max_workers
+
+        # Publish png / jpg with resized AVIF / WebP / JPEG variants (needs Pillow, see asset_pipeline)
+        self.responsive_images = responsive_images
+
+        # Publish mp4 / mov with a poster frame (needs ffmpeg, see asset_pipeline)
+        self.video_posters = video_posters
+
+        # Upload under content hashed keys, which compile_backward maps back to the original file names
+        self.hashed_keys = hashed_keys
+
         self.itext = '=!=HERE=!='
 
         self.search_text = f'https://{bucket_name}.s3.{region}.amazonaws.com'
 
         self.HREF_KEYS = {
-            'mp4': f"<video controls><source src='{self.itext}' type='video/mp4'>Your browser does not support the video tag.</video>",
-            'mov': f"<video controls><source src='{self.itext}'>Your browser does not support the video tag.</video>",
+            'mp4': f"{VIDEO_TAG}<source src='{self.itext}' type='video/mp4'>Your browser does not support the video tag.</video>",
+            'mov': f"{VIDEO_TAG}<source src='{self.itext}'>Your browser does not support the video tag.</video>",
             'pdf': f"<embed src='{self.itext}' type='application/pdf'>",
             'png': f"<img src='{self.itext}'>",
             'jpg': f"<img src='{self.itext}'>",
@@ -110,6 +339,7 @@ class LinkCompiler:
         }
 
         self.HTML_KEYS = {
+            '<picture': '</picture>',
             '<video': '</video>',
             '<embed': '>',
             '<img': '>',
@@ -119,73 +349,224 @@ class LinkCompiler:
             '"': '"',
             "'": "'"
         }
+
+        self.url_pattern = re.compile(re.escape(self.search_text))
+
+        self.html_start_pattern = quasi_pattern(*self.HTML_KEYS)
     
+    @traced('compile.compile_forward')
     def compile_forward(self, input_string: str, project_name, cloud = False):
         '''Compile a designated string, converting local paths to web paths
-        
-        (If selected for cloud, this function does do the uploading)'''
 
+        (If selected for cloud, this function does do the uploading, in parallel)'''
 
-        while CONTENT_FLAG_STRING in input_string:
+        flags = []
 
-            parsed = parse_block(input_string, CONTENT_FLAG_STRING, '\n')
+        for flag_start, flag_end, parsed in tokenize_content_flags(input_string):
 
-            path = parsed.replace('"', '')
+            flags.append((flag_start, flag_end) + self._parse_flag(parsed))
 
-            file_type = os.path.basename(path).partition('.')[2].lower()
+        annotate(text_bytes = len(input_string), assets = len(flags))
 
-            if not file_type in self.HREF_KEYS:
-                raise ValueError(f'Invalid file type: {file_type}\nAttempted to compile: {path}')
+        migrated, variants, posters = self.migrate_assets([path for _, _, path, _ in flags], project_name, cloud)
 
-            new_path = migrate(path, self.client, project_name, to_remote = cloud)
+        output = []
 
-            processed_file = self.HREF_KEYS[file_type].replace(self.itext, new_path, 1)
+        last_index = 0
 
-            if not CONTENT_FLAG_STRING + parsed in input_string:
-                print(CONTENT_FLAG_STRING + parsed)
+        for flag_start, flag_end, path, file_type in flags:
 
-                print(input_string)
+            processed_file = self._render_flag(path, file_type, migrated, variants, posters)
 
-                raise LookupError('Could not forward compile string')
+            output.append(input_string[last_index: flag_start])
+            output.append(processed_file)
 
-            input_string = input_string.replace(CONTENT_FLAG_STRING + parsed, processed_file, 1)
-        
-        return input_string
-        
+            last_index = flag_end
 
-    def _single_rev_html_replacement(self, input_string):
-        url_location = input_string.find(self.search_text)
+        output.append(input_string[last_index:])
 
-        url_block = list(optional_block_targeting(input_string, url_location, self.QUOTE_KEYS))
+        return ''.join(output)
 
-        url_block[0] += 1
-        url_block[1] -= 1
+    def _parse_flag(self, parsed: str):
+        '''Returns the (path, file type) of a content flag, or raises ValueError for a type there is no template for'''
 
-        url = isolate_block(input_string, url_block)
+        path = parsed.replace('"', '')
 
-        html_element = isolate_block(input_string, optional_block_targeting(input_string, url_location, self.HTML_KEYS))
+        file_type = os.path.basename(path).partition('.')[2].lower()
 
-        self.client.download_url_to_directory(url, '../projects/temp')
+        if not file_type in self.HREF_KEYS:
+            raise ValueError(f'Invalid file type: {file_type}\nAttempted to compile: {path}')
 
-        new_location = os.path.join('../projects/temp', os.path.basename(url))
+        return path, file_type
 
-        return input_string.replace(html_element, '\n\n' + CONTENT_FLAG_STRING + new_location + '\n\n')
-    
+    def migrate_assets(self, paths: List[str], project_name, cloud = False):
+        '''
+        Migrate a batch of files, along with the responsive variants of any images and the posters of any videos among them.
+
+        Returns (migrated, variants, posters): file path -> migrated path for every file, variant and poster,
+        image path -> list of [variant path, width, format], and video path -> poster path
+        '''
+
+        variants = build_variants(paths, max_workers = self.max_workers) if self.responsive_images else {}
+
+        posters = build_posters(paths, max_workers = self.max_workers) if self.video_posters else {}
+
+        derived_paths = [variant_path for image_variants in variants.values() for variant_path, _, _ in image_variants] + list(posters.values())
+
+        migrated = migrate_all(list(paths) + derived_paths, self.client, project_name, to_remote = cloud, max_workers = self.max_workers, hashed_keys = self.hashed_keys)
+
+        return migrated, variants, posters
+
+    def _render_flag(self, path: str, file_type: str, migrated, variants, posters):
+
+        processed_file = self.HREF_KEYS[file_type].replace(self.itext, migrated[path], 1)
+
+        if variants.get(path):
+            return render_picture(migrated[path], [(migrated[variant_path], width, variant_format) for variant_path, width, variant_format in variants[path]])
+
+        if path in posters:
+            return render_video(processed_file, migrated[path], migrated[posters[path]])
+
+        return processed_file
+
+    def compile_forward_chunks(self, chunk_source, project_name, cloud = False):
+        '''Streaming compile_forward. Yields the compiled text in pieces, never holding the whole document
+
+        chunk_source is called twice, and must return a fresh iterable of the input's chunks each time (see read_chunks).
+        The first pass finds and migrates every flagged file, the second writes out the text'''
+
+        paths = [self._parse_flag(parsed)[0] for text, parsed in split_content_flags(chunk_source()) if text is None]
+
+        annotate(assets = len(paths))
+
+        migrated, variants, posters = self.migrate_assets(paths, project_name, cloud)
+
+        for text, parsed in split_content_flags(chunk_source()):
+
+            if text is not None:
+                yield text
+                continue
+
+            path, file_type = self._parse_flag(parsed)
+
+            yield self._render_flag(path, file_type, migrated, variants, posters)
+
+    @traced('compile.locate_assets')
+    def _locate_assets(self, input_string: str):
+        '''
+        Find every bucket url and its enclosing html element in one pass over the string
+
+        Returns a list of (element_start, element_end, url), in document order
+        '''
+
+        element_starts = []
+        element_keys = []
+
+        for match in self.html_start_pattern.finditer(input_string):
+            element_starts.append(match.start())
+            element_keys.append(match.group().replace(' ', '').lower())
+
+        assets = []
+
+        cursor = 0
+
+        for url_match in self.url_pattern.finditer(input_string):
+
+            url_location = url_match.start()
+
+            if url_location < cursor:
+                # Url belongs to an element that has already been consumed
+                continue
+
+            # Isolate the url from its surrounding quotes
+
+            quote_location = max(input_string.rfind(quote, cursor, url_location) for quote in self.QUOTE_KEYS)
+
+            if quote_location == -1:
+                raise IndexError('Blocks not found')
+
+            url_end = input_string.find(self.QUOTE_KEYS[input_string[quote_location]], quote_location + 2)
+
+            if url_end == -1:
+                raise IndexError('End of target block not found')
+
+            url = input_string[quote_location + 1: url_end]
+
+            # Isolate the html element holding the url
+
+            element_index = bisect_right(element_starts, url_location) - 1
+
+            if element_index == -1 or element_starts[element_index] < cursor:
+                raise IndexError('Blocks not found')
+
+            element_start = element_starts[element_index]
+
+            end_key = self.HTML_KEYS[element_keys[element_index]]
+
+            end_location = quasi_find(input_string, end_key.lower(), element_start + 1)
+
+            if end_location == -1:
+                raise IndexError('End of target block not found')
+
+            element_end = quasi_end_of_string(input_string, end_key, end_location)
+
+            assets.append((element_start, element_end, url))
+
+            cursor = element_end
+
+        annotate(text_bytes = len(input_string), assets = len(assets))
+
+        return assets
+
+    @traced('compile.replace_assets')
+    def _replace_assets(self, input_string: str, assets):
+        '''
+        Download the located assets in one batch, and rebuild the string with the elements swapped for content flags
+        '''
+
+        urls = [url for _, _, url in assets]
+
+        downloads = self.client.download_urls_to_directory(urls, '../projects/temp', max_workers = self.max_workers)
+
+        for url, local_path in downloads.items():
+            if local_path is None:
+                print(f'Warning: Could not download: {url}')
+
+        # The same names the downloads were given, failed or not, so repeated file names stay apart
+        locations = local_paths(urls, '../projects/temp')
+
+        output = []
+
+        last_index = 0
+
+        for element_start, element_end, url in assets:
+
+            new_location = locations[url]
+
+            output.append(input_string[last_index: element_start])
+            output.append('\n\n' + CONTENT_FLAG_STRING + new_location + '\n\n')
+
+            last_index = element_end
+
+        output.append(input_string[last_index:])
+
+        return ''.join(output)
+
+    @traced('compile.compile_backward')
     def compile_backward(self, input_string: str):
 
         '''
         Download href'd files in the input string, and replace the html attributes with local content flags
         '''
 
-        while self.search_text in input_string:
-
-            input_string = self._single_rev_html_replacement(input_string)
+        input_string = self._replace_assets(input_string, self._locate_assets(input_string))
 
         return input_string.replace('</', '\n</')
     
+    @traced('compile.reverse_compile_image')
     def reverse_compile_image(self, img_html: str):
 
-        flagged_string = self._single_rev_html_replacement(img_html)
+        flagged_string = self._replace_assets(img_html, self._locate_assets(img_html)[:1])
 
         raw_path = flagged_string.replace(CONTENT_FLAG_STRING, '').replace('\n', '')
 
@@ -193,21 +574,253 @@ class LinkCompiler:
 
         return f'<img src="temp/{name}">'
 
-def compile(link_compiler: LinkCompiler, project_json_path: str, short_title: str, long_title: str, image_path: str, description: str, techs: List[str], text_qhtml_path: str, tags: List[str], github_link: str, href_link: str, local: bool = True):
+def asset_signature(file_path: str):
+    '''Cheap change detector for a referenced asset: its path, mtime and size'''
+
+    try:
+        stat = os.stat(file_path)
+    except (OSError, TypeError, ValueError):
+        return [file_path, None, None]
+
+    return [file_path, stat.st_mtime, stat.st_size]
+
+class CompileCache:
+    '''
+    Previously compiled project fragments, each stored against a hash of the inputs that produced it.
+
+    Kept in memory, and optionally persisted to a json file
+    '''
+
+    def __init__(self, cache_path = None):
+
+        self.cache_path = cache_path
+
+        self.fragments = {}
+
+        if cache_path is not None:
+            try:
+                with open(cache_path) as cache_file:
+                    self.fragments = json.load(cache_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+    @staticmethod
+    def input_hash(inputs):
+        return hashlib.sha256(json.dumps(inputs, sort_keys = True).encode()).hexdigest()
+
+    def lookup(self, name: str, inputs):
+        '''Return the fragment stored under name if its inputs are unchanged, otherwise None'''
+
+        fragment = self.fragments.get(name)
+
+        if fragment is None or fragment['inputs'] != self.input_hash(inputs):
+            return None
+
+        return fragment['value']
+
+    def store(self, name: str, inputs, value):
+
+        self.fragments[name] = {'inputs': self.input_hash(inputs), 'value': value}
+
+        return value
+
+    def save(self):
+
+        if self.cache_path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok = True)
+
+        with open(self.cache_path, 'w') as cache_file:
+            json.dump(self.fragments, cache_file)
+
+@lru_cache(maxsize = None)
+def streaming_min_parser():
+    '''The StreamingMinParser class. Made on first use, so htmlmin is only imported once something is minified'''
+
+    from htmlmin.parser import HTMLMinParser
+
+    class StreamingMinParser(HTMLMinParser):
+        '''htmlmin's parser, with its finished output taken as it goes rather than joined at the end'''
+
+        def reset(self):
+            self.drained = False
+            super().reset()
+
+        def drain(self):
+            '''Take the output so far, keeping the last piece, which handle_data looks back at'''
+
+            if len(self._data_buffer) < 2:
+                return ''
+
+            self.drained = True
+
+            finished = ''.join(self._data_buffer[:-1])
+
+            del self._data_buffer[:-1]
+
+            return finished
+
+        def handle_decl(self, decl):
+
+            if self.drained:
+                # Whitespace is only dropped before a doctype at the very start, which has already gone out
+                self._data_buffer.append('<!' + decl + '>')
+                self._after_doctype = True
+                return
+
+            super().handle_decl(decl)
+
+    return StreamingMinParser
+
+class StreamingMinifier:
+    '''
+    Minifies html fed in pieces, giving back the minified output as it becomes final.
+
+    Input is handed to the parser up to its last "<", so runs of text are never split across feeds,
+    and the output matches htmlmin.minify over the whole document
+    '''
+
+    def __init__(self, **options):
+        self.parser = streaming_min_parser()(**options)
+        self.pending = ''
+
+    def feed(self, text: str):
+
+        self.pending += text
+
+        split = self.pending.rfind('<') + 1
+
+        if split == 0:
+            return ''
+
+        self.parser.feed(self.pending[:split])
+
+        self.pending = self.pending[split:]
+
+        return self.parser.drain()
+
+    def close(self):
+
+        self.parser.feed(self.pending)
+        self.pending = ''
+
+        self.parser.close()
+
+        return self.parser.result
+
+def compile_project_image(link_compiler: LinkCompiler, image_path: str, ref_name: str, local: bool = True):
+    '''
+    Returns (html, migrated): the project image's html, and whether the image made it to its destination.
+
+    An image that could not be migrated (none assigned yet, a failed upload) still gets its html, but it links nowhere
+    '''
+
+    variants = build_variants([image_path], max_workers = link_compiler.max_workers) if link_compiler.responsive_images else {}
+
+    if not variants.get(image_path):
+        migrated_path = migrate(image_path, link_compiler.client, ref_name, to_remote=not local, hashed_key=link_compiler.hashed_keys)
+
+        return f'<img src="{migrated_path}">', migrated_path is not None
+
+    # Raises a MigrationError rather than link anything that failed
+    migrated, variants, _ = link_compiler.migrate_assets([image_path], ref_name, cloud = not local)
+
+    return render_picture(migrated[image_path], [(migrated[variant_path], width, variant_format) for variant_path, width, variant_format in variants[image_path]], quote = '"'), True
+
+def compile_project_text(link_compiler: LinkCompiler, file_content: str, ref_name: str, local: bool = True):
+
+    import htmlmin
+
+    compiled_text = link_compiler.compile_forward(file_content, ref_name, cloud = not local)
+
+    with span('compile.minify', text_bytes = len(compiled_text)):
+        return htmlmin.minify(compiled_text, **MINIFY_OPTIONS)
+
+def streamed_text_inputs(text_qhtml_path: str):
+    '''The projectText cache inputs of a qhtml file (a hash of it, and the signatures of the files it flags), read as a stream'''
+
+    file_hash = hashlib.sha256()
+
+    def hashed_chunks():
+        for chunk in read_chunks(text_qhtml_path):
+            file_hash.update(chunk.encode())
+            yield chunk
+
+    signatures = [asset_signature(parsed.replace('"', '')) for text, parsed in split_content_flags(hashed_chunks()) if text is None]
+
+    return [file_hash.hexdigest()] + signatures
+
+def minified_pieces(text_pieces):
+    '''Minify html arriving in pieces, giving the output as it becomes final. Joined, it is htmlmin.minify of the whole'''
+
+    minifier = StreamingMinifier(**MINIFY_OPTIONS)
+
+    for piece in text_pieces:
+        yield minifier.feed(piece)
+
+    yield minifier.close()
+
+@traced('compile')
+def compile(link_compiler: LinkCompiler, project_json_path: str, short_title: str, long_title: str, image_path: str, description: str, techs: List[str], text_qhtml_path: str, tags: List[str], github_link: str, href_link: str, local: bool = True, cache: CompileCache = None):
+    '''
+    Compile a project into its json file, a header plus its body documents (see project_documents).
+
+    If a cache is given, fragments whose inputs are unchanged are reused, and an unchanged json is not rewritten.
+    qhtml files past STREAM_THRESHOLD are streamed through the compiler and into the body, so memory stays bounded.
+    Returns True if the json file was written
+    '''
+
+    if cache is None:
+        cache = CompileCache()
 
     ref_name = os.path.basename(project_json_path).partition('.')[0]
 
+    annotate(project = ref_name, local = local)
+
+    # Local, remote and hashed remote compiles produce different links, so cache them apart
+    cache_prefix = f'{ref_name}:{["remote", "local"][local]}'
+
+    if link_compiler.hashed_keys and not local:
+        cache_prefix += ':hashed'
+
     digest = {}
 
     digest['projectShortTitle'] = short_title.strip()
     digest['projectLongTitle'] = long_title.strip()
 
-    digest['projectImage'] = f'<img src="{migrate(image_path, link_compiler.client, ref_name, to_remote=not local)}">'
+    with span('compile.project_image') as args:
+
+        image_inputs = asset_signature(image_path)
+
+        digest['projectImage'] = cache.lookup(f'{cache_prefix}:projectImage', image_inputs)
+
+        args['cached'] = digest['projectImage'] is not None
+
+        if digest['projectImage'] is None:
+            digest['projectImage'], image_migrated = compile_project_image(link_compiler, image_path, ref_name, local)
+
+            # A failed migration is tried again next compile, rather than reused until the image itself changes
+            if image_migrated:
+                cache.store(f'{cache_prefix}:projectImage', image_inputs, digest['projectImage'])
 
     digest['projectDescription'] = f'<p>{description.strip()}</p>'
 
-    for index, svg_text in enumerate(techs):
-        techs[index] = resize_svg(svg_text)
+    with span('compile.techs', count = len(techs)) as args:
+
+        # Svgs are stored once in the icon registry, the project only lists their references
+        tech_references = cache.lookup(f'{cache_prefix}:applicableTechnologies', techs)
+
+        if tech_references is not None and not all(os.path.exists(icon_path(reference)) for reference in referenced_icons(tech_references)):
+            # An icon was removed from the registry since, write it again
+            tech_references = None
+
+        args['cached'] = tech_references is not None
+
+        if tech_references is None:
+            tech_references = cache.store(f'{cache_prefix}:applicableTechnologies', list(techs), [register_icon(resize_svg(svg_text)) for svg_text in techs])
+
+    techs[:] = tech_references
 
     digest['applicableTechnologies'] = techs
 
@@ -216,18 +829,63 @@ def compile(link_compiler: LinkCompiler, project_json_path: str, short_title: st
     attach_optional_field(href_link, digest, 'forceHref')
     attach_optional_field(github_link, digest, 'githubLink')
 
-    with open(text_qhtml_path) as content:
+    if os.path.getsize(text_qhtml_path) > STREAM_THRESHOLD:
+
+        # Too big to hold, so only its inputs are cached, and the json is compared by those
+        with span('compile.project_text', streamed = True):
+            text_inputs = streamed_text_inputs(text_qhtml_path)
+
+        if cache.lookup(f'{cache_prefix}:output', [digest, text_inputs, asset_signature(project_json_path)]) is not None and bodies_present(project_json_path):
+            return False
+
+        with span('compile.write_json', streamed = True):
+
+            text_pieces = link_compiler.compile_forward_chunks(lambda: read_chunks(text_qhtml_path), ref_name, cloud = not local)
+
+            for path in write_project(project_json_path, digest, minified_pieces(text_pieces)):
+                add_bytes(os.path.getsize(path))
+
+        cache.store(f'{cache_prefix}:output', [digest, text_inputs, asset_signature(project_json_path)], True)
+
+        cache.save()
+
+        return True
+
+    with span('compile.read_qhtml'):
+
+        with open(text_qhtml_path) as content:
+
+            file_content = content.read()
+
+        add_bytes(len(file_content))
+
+    with span('compile.project_text') as args:
+
+        text_inputs = [file_content] + [asset_signature(parsed.replace('"', '')) for _, _, parsed in tokenize_content_flags(file_content)]
+
+        digest['projectText'] = cache.lookup(f'{cache_prefix}:projectText', text_inputs)
+
+        args['cached'] = digest['projectText'] is not None
+
+        # compile_forward raises a MigrationError rather than link a file that failed to migrate, so only complete text is stored
+        if digest['projectText'] is None:
+            digest['projectText'] = cache.store(f'{cache_prefix}:projectText', text_inputs, compile_project_text(link_compiler, file_content, ref_name, local))
+
+    # The json's own signature is included, so edits made to it outside the compiler force a rewrite
+    if cache.lookup(f'{cache_prefix}:output', [digest, asset_signature(project_json_path)]) is not None and bodies_present(project_json_path):
+        # Nothing changed since the last write
+        return False
 
-        file_content = content.read()
+    with span('compile.write_json'):
 
-        compiled_text = link_compiler.compile_forward(file_content, ref_name, cloud = not local)
+        for path in write_project(project_json_path, digest):
+            add_bytes(os.path.getsize(path))
 
-        minified_html = htmlmin.minify(compiled_text, remove_empty_space=True, remove_optional_attribute_quotes=False)
+    cache.store(f'{cache_prefix}:output', [digest, asset_signature(project_json_path)], True)
 
-        digest['projectText'] = minified_html
+    cache.save()
 
-    with open(project_json_path, 'w') as output_file:
-        json.dump(digest, output_file)
+    return True
 
 if __name__ == '__main__':
 
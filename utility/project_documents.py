@@ -0,0 +1,281 @@
+'''
+Projects are written as a light header and a separately loaded body.
+
+The header (<name>.json) holds every field but projectText, and lists its body documents under projectBody.
+The body is {"projectText": ...} in bodies/<name>.<hash>.json beside the header, split into several documents at top level
+headings once it passes BODY_CHUNK_SIZE. Bodies are named by their content and never change once written,
+so writing the header is what switches a reader to a new body, and the old body stays valid for anyone holding the old header.
+
+Projects in the single file format (projectText inside the json) are still read as they are
+'''
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+from html.parser import HTMLParser
+
+BODY_DIRECTORY_NAME = 'bodies'
+
+BODY_CHUNK_SIZE = 256 * 1024 # None keeps every body in one document
+BODY_HASH_LENGTH = 16
+
+# A new body document may start at any of these, when nothing else is open
+SECTION_TAGS = ('h1', 'h2', 'h3')
+
+VOID_ELEMENTS = ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr')
+
+class SectionFinder(HTMLParser):
+    '''Finds the offsets where top level sections start, in html fed in pieces'''
+
+    def __init__(self):
+        super().__init__(convert_charrefs = False)
+
+        self.open_tags = []
+        self.boundaries = []
+
+        # Offset of the start of every line fed so far, getpos counts in lines
+        self.line_starts = [0]
+        self.fed = 0
+
+    def feed(self, text: str):
+
+        newline = text.find('\n')
+
+        while newline != -1:
+            self.line_starts.append(self.fed + newline + 1)
+            newline = text.find('\n', newline + 1)
+
+        self.fed += len(text)
+
+        super().feed(text)
+
+    def parsed(self):
+        '''Offset up to which the input has been parsed, every boundary before it has been found'''
+
+        return self.fed - len(self.rawdata)
+
+    def handle_starttag(self, tag, attrs):
+
+        if not self.open_tags and tag in SECTION_TAGS:
+            line, column = self.getpos()
+            self.boundaries.append(self.line_starts[line - 1] + column)
+
+        if tag not in VOID_ELEMENTS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+
+        # Closes everything opened since, which covers optional end tags. Stray end tags are ignored
+        if tag in self.open_tags:
+            del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+
+class BodyWriter:
+    '''
+    Writes a project's text, fed in pieces, into body documents in directory.
+
+    Text is held back only until it has been parsed, so memory stays bounded however long the text is
+    '''
+
+    def __init__(self, directory: str, ref_name: str, chunk_size = BODY_CHUNK_SIZE):
+        self.directory = directory
+        self.ref_name = ref_name
+        self.chunk_size = chunk_size
+
+        self.finder = SectionFinder()
+
+        # Fed, but not written yet, starting at offset written
+        self.pending = ''
+        self.written = 0
+
+        self.chunk_start = 0
+        self.chunk_file = None
+        self.chunk_path = None
+        self.chunk_hash = None
+
+        self.names = []
+
+    def feed(self, text: str):
+
+        self.finder.feed(text)
+
+        self.pending += text
+
+        self._flush(self.finder.parsed())
+
+    def close(self):
+        '''Write out the rest, returning the names of the body documents in order'''
+
+        self.finder.close()
+
+        self._flush(self.written + len(self.pending))
+
+        if self.chunk_file is not None or not self.names:
+            self._finish_chunk()
+
+        return self.names
+
+    def _flush(self, end):
+        # Write the pending text up to end, starting a new document at each boundary far enough into the current one
+
+        for boundary in self.finder.boundaries:
+            if self.chunk_size is not None and boundary - self.chunk_start >= self.chunk_size:
+                self._write(boundary - self.written)
+                self._finish_chunk()
+                self.chunk_start = boundary
+
+        self.finder.boundaries.clear()
+
+        self._write(end - self.written)
+
+    def _open_chunk(self):
+
+        os.makedirs(self.directory, exist_ok = True)
+
+        descriptor, self.chunk_path = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+
+        self.chunk_file = open(descriptor, 'w')
+        self.chunk_file.write('{"projectText": "')
+
+        self.chunk_hash = hashlib.sha256()
+
+    def _write(self, length):
+
+        if length <= 0:
+            return
+
+        text, self.pending = self.pending[:length], self.pending[length:]
+
+        self.written += length
+
+        if self.chunk_file is None:
+            self._open_chunk()
+
+        # Identical to json.dump of the whole text, escaping works character by character
+        self.chunk_file.write(json.dumps(text)[1:-1])
+
+        self.chunk_hash.update(text.encode())
+
+    def _finish_chunk(self):
+
+        if self.chunk_file is None:
+            # An empty body still gets its (empty) document
+            self._open_chunk()
+
+        self.chunk_file.write('"}')
+        self.chunk_file.close()
+        self.chunk_file = None
+
+        name = f'{self.ref_name}.{self.chunk_hash.hexdigest()[:BODY_HASH_LENGTH]}.json'
+
+        os.replace(self.chunk_path, os.path.join(self.directory, name))
+
+        self.names.append(name)
+
+    def abort(self):
+        '''Drop a document left half written'''
+
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+            self.chunk_file = None
+
+            os.remove(self.chunk_path)
+
+def body_directory(project_json_path: str):
+    return os.path.join(os.path.dirname(project_json_path), BODY_DIRECTORY_NAME)
+
+def ref_name_of(project_json_path: str):
+    '''The header's name without .json. Only the extension goes, so foo.json and foo.bar.json never share bodies'''
+
+    name = os.path.basename(project_json_path)
+
+    return name[:-len('.json')] if name.endswith('.json') else name
+
+def is_body_of(name: str, ref_name: str):
+    '''Whether name is exactly <ref_name>.<hash>.json, a body document of that project and no other'''
+
+    return re.fullmatch(re.escape(ref_name) + r'\.[0-9a-f]{%d}\.json' % BODY_HASH_LENGTH, name) is not None
+
+def write_project(project_json_path: str, digest, text_pieces = None, chunk_size = BODY_CHUNK_SIZE):
+    '''
+    Write a project as its body documents, then its header. The text is digest's projectText, or text_pieces when given.
+
+    Documents of older bodies of the project are removed once the header no longer lists them.
+    Returns the paths written, header last
+    '''
+
+    header = {field: value for field, value in digest.items() if field != 'projectText'}
+
+    writer = BodyWriter(body_directory(project_json_path), ref_name_of(project_json_path), chunk_size)
+
+    try:
+        for piece in ([digest['projectText']] if text_pieces is None else text_pieces):
+            writer.feed(piece)
+
+        names = writer.close()
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    header['projectBody'] = [f'{BODY_DIRECTORY_NAME}/{name}' for name in names]
+
+    temp_path = project_json_path + '.tmp'
+
+    with open(temp_path, 'w') as header_file:
+        json.dump(header, header_file)
+
+    # Never leave a half written header in place of the last good one
+    os.replace(temp_path, project_json_path)
+
+    remove_stale_bodies(project_json_path, names)
+
+    return [os.path.join(body_directory(project_json_path), name) for name in names] + [project_json_path]
+
+def remove_stale_bodies(project_json_path: str, names):
+
+    directory = body_directory(project_json_path)
+
+    ref_name = ref_name_of(project_json_path)
+
+    try:
+        existing = os.listdir(directory)
+    except FileNotFoundError:
+        return
+
+    for name in existing:
+        if is_body_of(name, ref_name) and name not in names:
+            os.remove(os.path.join(directory, name))
+
+def body_files(project_json_path: str, header, key_prefix = 'projects/'):
+    '''(local path, s3 key) of every body document a header lists, none for the single file format'''
+
+    directory = os.path.dirname(project_json_path)
+
+    return [(os.path.join(directory, *body.split('/')), key_prefix + body) for body in header.get('projectBody', [])]
+
+def bodies_present(project_json_path: str):
+    '''Whether the project's header exists, and every body it lists'''
+
+    try:
+        with open(project_json_path) as header_file:
+            header = json.load(header_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+    return all(os.path.exists(path) for path, _ in body_files(project_json_path, header))
+
+def load_project_text(project_json_path: str, header):
+    '''The full projectText of a project, read from its bodies, or from the header itself in the single file format'''
+
+    if 'projectText' in header:
+        return header['projectText']
+
+    text = []
+
+    for path, _ in body_files(project_json_path, header):
+        with open(path) as body_file:
+            text.append(json.load(body_file)['projectText'])
+
+    return ''.join(text)
@@ -1,10 +1,21 @@
-from s3_utils import S3Wrapper
+from s3_utils import S3Wrapper, TRANSFER_WORKERS
 from typing import List
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from project_compiler import LinkCompiler
+from tech_icons import referenced_icons, icon_path, icon_key
+from project_documents import body_files
 
 BUCKET_NAME = 'logan-public-files'
 
+INDEX_NAME = 'projects.json'
+INDEX_KEY = f'projects/{INDEX_NAME}'
+
+# Fields the portfolio page needs to render a project card
+INDEX_FIELDS = ('projectShortTitle', 'projectLongTitle', 'projectImage', 'projectDescription', 'forceHref')
+
 def ensure_proj_formatting(project_name: str):
 
     project_name = os.path.basename(project_name)
@@ -12,43 +23,203 @@ def ensure_proj_formatting(project_name: str):
     if not project_name.endswith('.json'):
         project_name += '.json'
 
-    if project_name == 'projects.json':
+    if project_name == INDEX_NAME:
         raise ValueError('This project name is reserved for system functionality. Please pick a different one')
 
     return project_name
 
+def project_card(project_key: str, project_data: dict):
+
+    card = {field: project_data[field] for field in INDEX_FIELDS if field in project_data}
+
+    card['jsonname'] = project_key
+
+    return card
+
 class ProjectHandler:
-    def __init__(self, bucket_name = BUCKET_NAME, profile = 'personal'):
+    def __init__(self, bucket_name = BUCKET_NAME, profile = 'personal', client: S3Wrapper = None):
 
-        self.client = S3Wrapper(bucket_name, profile_name=profile)
+        # A client can be passed in where it needs settings of its own (batch compile workers)
+        self.client = client if client is not None else S3Wrapper(bucket_name, profile_name=profile)
 
         self.link_compiler = LinkCompiler(self.client, bucket_name)
 
     def list_projects(self):
 
-        all_paths: List[str] = self.client.list_directory('projects')[1:]
+        all_paths: List[str] = self.client.list_directory('projects', use_cache = True)[1:]
+
+        project_paths = [path.partition('projects/')[2] for path in all_paths if path != INDEX_KEY]
+
+        # Icons and project bodies sit in folders below the projects
+        return [path for path in project_paths if '/' not in path]
+
+    def project_icons(self, project_name, directory = '../projects'):
+        '''(local path, s3 key) of every registry icon a local project lists'''
+
+        with open(os.path.join(directory, project_name)) as project_file:
+            techs = json.load(project_file).get('applicableTechnologies', [])
+
+        return [(icon_path(reference), icon_key(reference)) for reference in referenced_icons(techs)]
+
+    def push_icons(self, project_name, directory = '../projects'):
+        '''Upload the icons a local project lists. Unchanged icons are skipped by the upload manifest'''
+
+        transfers = self.project_icons(project_name, directory)
+
+        if not transfers:
+            return
+
+        failed = [s3_key for s3_key, url in asyncio.run(self.client.upload_many(transfers)).items() if url is None]
+
+        if failed:
+            raise RuntimeError(f'Could not upload the icons {failed}')
+
+    def pull_icons(self, project_names: List[str]):
+        '''Download the icons the local projects list that are not in the local registry yet'''
+
+        transfers = {s3_key: local_path for project_name in project_names for local_path, s3_key in self.project_icons(project_name) if not os.path.exists(local_path)}
 
-        return [path.partition('projects/')[2] for path in all_paths]
+        if transfers:
+            asyncio.run(self.client.download_many(transfers.items()))
 
     def pull_project(self, project_name):
 
         project_name = ensure_proj_formatting(project_name)
 
-        download_to_location = os.path.join('../projects', project_name)
+        if self.pull_projects([project_name])[os.path.join('projects', project_name)] is None:
+            raise RuntimeError(f'Could not pull {project_name}')
 
-        download_from_location = os.path.join('projects', project_name)
+    def pull_projects(self, project_names: List[str]):
+        '''
+        Download projects, with their bodies and icons, concurrently.
 
-        self.client.download_file(download_from_location, download_to_location)
-    
-    def upload_project(self, project_name):
+        A header is downloaded beside the local copy, and only replaces it once every body it lists is in place,
+        so a failed pull leaves the last good copy. Returns a dict of s3 key -> local path, or None for each project that failed
+        '''
+
+        project_names = [ensure_proj_formatting(project_name) for project_name in project_names]
+
+        transfers = [(os.path.join('projects', project_name), os.path.join('../projects', project_name) + '.part') for project_name in project_names]
+
+        headers = asyncio.run(self.client.download_many(transfers))
+
+        project_bodies = {}
+
+        for s3_key, part_path in transfers:
+
+            if headers[s3_key] is None:
+                continue
+
+            with open(part_path) as header_file:
+                header = json.load(header_file)
+
+            # Bodies never change once written, so one already here is current
+            project_bodies[s3_key] = [(body_key, body_path) for body_path, body_key in dict.fromkeys(body_files(part_path, header)) if not os.path.exists(body_path)]
+
+        bodies = asyncio.run(self.client.download_many([body for pending in project_bodies.values() for body in pending]))
+
+        results = {}
+
+        for s3_key, part_path in transfers:
+
+            results[s3_key] = None
+
+            if s3_key not in project_bodies:
+                continue
+
+            if any(bodies[body_key] is None for body_key, _ in project_bodies[s3_key]):
+                print(f'Warning: Could not pull every body of {s3_key}, keeping the local copy')
+                os.remove(part_path)
+                continue
+
+            local_path = part_path[:-len('.part')]
+
+            os.replace(part_path, local_path)
+
+            results[s3_key] = local_path
+
+        self.pull_icons([project_name for project_name, (s3_key, _) in zip(project_names, transfers) if results[s3_key] is not None])
+
+        return results
+
+    def push_bodies(self, project_name, directory = '../projects'):
+        '''Upload the body documents a local project lists. Unchanged bodies are skipped by the upload manifest'''
+
+        project_path = os.path.join(directory, project_name)
+
+        with open(project_path) as project_file:
+            header = json.load(project_file)
+
+        # A body repeated in the project is one document
+        transfers = list(dict.fromkeys(body_files(project_path, header)))
+
+        if not transfers:
+            return
+
+        failed = [s3_key for s3_key, url in asyncio.run(self.client.upload_many(transfers)).items() if url is None]
+
+        if failed:
+            raise RuntimeError(f'Could not upload the bodies {failed}')
+
+    def publish_project(self, project_name, directory = '../projects'):
+        '''Upload a local project from directory: its icons and bodies, then its header'''
 
         project_name = ensure_proj_formatting(project_name)
 
-        upload_from_location = os.path.join('../projects', project_name)
+        upload_from_location = os.path.join(directory, project_name)
 
         upload_to_location = os.path.join('projects', project_name)
 
-        self.client.upload_file(upload_from_location, upload_to_location)
+        # Icons and bodies go first, so the published header never lists anything that is not there yet
+        self.push_icons(project_name, directory)
+        self.push_bodies(project_name, directory)
+
+        if self.client.upload_file(upload_from_location, upload_to_location) is None:
+            raise RuntimeError(f'Could not upload {project_name}')
+
+    def upload_project(self, project_name):
+
+        project_name = ensure_proj_formatting(project_name)
+
+        self.publish_project(project_name)
+
+        self.client.push_manifest()
+
+        self.update_index(project_name)
+
+    def build_index(self):
+        '''Rebuild the projects index from every project in the bucket, and upload it'''
+
+        project_keys = [f'projects/{project_name}' for project_name in self.list_projects()]
+
+        with ThreadPoolExecutor(max_workers = TRANSFER_WORKERS) as pool:
+            project_datas = list(pool.map(self.client.read_json, project_keys))
+
+        index = [project_card(key, data) for key, data in zip(project_keys, project_datas) if data is not None]
+
+        return self.client.write_json(INDEX_KEY, index)
+
+    def update_index(self, project_name):
+        '''Refresh a single project's card in the projects index, from its local copy'''
+
+        project_name = ensure_proj_formatting(project_name)
+
+        index = self.client.read_json(INDEX_KEY)
+
+        if index is None:
+            # No usable index yet, build it from scratch
+            return self.build_index()
+
+        with open(os.path.join('../projects', project_name)) as project_file:
+            project_data = json.load(project_file)
+
+        project_key = f'projects/{project_name}'
+
+        index = [card for card in index if card.get('jsonname') != project_key]
+        index.append(project_card(project_key, project_data))
+        index.sort(key = lambda card: card['jsonname'])
+
+        return self.client.write_json(INDEX_KEY, index)
     
 if __name__ == '__main__':
     
@@ -1,73 +1,794 @@
 import os
-import boto3
+import json
+import time
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
+from tracing import span, traced, add_bytes, annotate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TRANSFER_WORKERS = 8
+
+# Shared by every S3Wrapper in the process, sized above the sum of the thread pools that use it at once
+POOL_CONNECTIONS = 50
+
+# Adaptive retries back off, and rate limit the client, when S3 starts throttling
+RETRY_MODE = 'adaptive'
+MAX_ATTEMPTS = 10
+
+# Points every client at an S3 compatible stand-in (minio, moto server) instead of AWS, for testing
+ENDPOINT_ENVIRONMENT_VARIABLE = 'S3_ENDPOINT_URL'
+
+MANIFEST_PATH = '.cache/upload_manifest.json'
+MANIFEST_KEY = 'manifest/uploads.json'
+
+UPLOAD_STATE_DIRECTORY = '.cache/uploads'
+
+MB = 1024 * 1024
+
+MULTIPART_THRESHOLD = 64 * MB
+PART_SIZE = 16 * MB
+PART_WORKERS = 4
+
+LISTING_CACHE_PATH = '.cache/listings.json'
+LISTING_TTL = 5 * 60 # Seconds
+
+DELETE_BATCH_SIZE = 1000 # Most keys a single delete_objects call accepts
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'html': 'text/html; charset=utf-8',
+    'css': 'text/css; charset=utf-8',
+    'js': 'text/javascript; charset=utf-8',
+    'svg': 'image/svg+xml',
+    'xml': 'application/xml',
+    'txt': 'text/plain; charset=utf-8',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+    'mp4': 'video/mp4',
+    'mov': 'video/quicktime',
+    'pdf': 'application/pdf',
+}
+
+# Text formats worth precompressing, everything else is already compressed
+COMPRESSIBLE_TYPES = ('json', 'html', 'css', 'js', 'svg', 'xml', 'txt')
+
+COMPRESSION = 'gzip' # 'gzip', 'br' (needs the brotli package), or None
+
+COMPRESSION_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+SHORT_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Keys that are rewritten in place on every publish (project json, the index, the manifest)
+SHORT_CACHE_PREFIXES = ('projects/', 'manifest/')
+
+# Keys named by a hash of their content, which never change once written (tech icons, project bodies)
+IMMUTABLE_CACHE_PREFIXES = ('projects/icons/', 'projects/bodies/')
+
+def hash_file(file_path, chunk_size = 1024 * 1024):
+    """Sha256 of a file, read in chunks so large videos are never fully in memory"""
+
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def file_type(path):
+    return os.path.basename(path).rpartition('.')[2].lower()
+
+def cache_control_for(s3_key):
+    '''Cache policy of an object by its key, short for anything republished in place'''
+
+    if s3_key.startswith(IMMUTABLE_CACHE_PREFIXES):
+        return IMMUTABLE_CACHE_CONTROL
+
+    if s3_key.startswith(SHORT_CACHE_PREFIXES):
+        return SHORT_CACHE_CONTROL
+
+    return DEFAULT_CACHE_CONTROL
+
+def compress_to_file(source, destination, encoding):
+    '''Stream a readable binary file into destination, gzip or brotli compressed'''
+
+    if encoding == 'gzip':
+        # mtime 0 keeps the output identical for identical input
+        with gzip.GzipFile(fileobj = destination, mode = 'wb', compresslevel = 9, mtime = 0) as compressed:
+            shutil.copyfileobj(source, compressed, COMPRESSION_CHUNK_SIZE)
+        return
+
+    compressor = brotli.Compressor(quality = 11)
+
+    for chunk in iter(lambda: source.read(COMPRESSION_CHUNK_SIZE), b''):
+        destination.write(compressor.process(chunk))
+
+    destination.write(compressor.finish())
+
+def decompress_to_file(source, destination, encoding):
+    '''Stream a gzip or brotli encoded readable into destination'''
+
+    if encoding == 'gzip':
+        with gzip.GzipFile(fileobj = source, mode = 'rb') as decompressed:
+            shutil.copyfileobj(decompressed, destination, COMPRESSION_CHUNK_SIZE)
+        return
+
+    decompressor = brotli.Decompressor()
+
+    for chunk in iter(lambda: source.read(COMPRESSION_CHUNK_SIZE), b''):
+        destination.write(decompressor.process(chunk))
+
+def decode_body(body: bytes, encoding):
+
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+
+    if encoding == 'br':
+        return brotli.decompress(body)
+
+    return body
+
+def local_paths(urls, directory):
+    '''
+    Where each of a batch of s3 urls is downloaded to in directory, as a dict of url -> local path.
+
+    Files keep their names, unless two urls share one (hashed keys of the same file in different versions).
+    Then the later ones are prefixed with the folder above them, so no download overwrites another
+    '''
+
+    paths = {}
+    taken = set()
+
+    for url in dict.fromkeys(urls):
+
+        file_name = os.path.basename(url)
+
+        if file_name in taken:
+            file_name = os.path.basename(os.path.dirname(url)) + '-' + file_name
+
+        stem, extension = os.path.splitext(file_name)
+
+        suffix = 1
+
+        while file_name in taken:
+            suffix += 1
+            file_name = f'{stem}-{suffix}{extension}'
+
+        taken.add(file_name)
+
+        paths[url] = os.path.join(directory, file_name)
+
+    return paths
+
+shared_clients = {}
+shared_clients_lock = threading.Lock()
+
+def shared_client(profile_name, region, endpoint_url = None):
+    '''
+    The pooled S3 client for a profile, region and endpoint, built on first use and shared from then on.
+
+    boto3 clients are thread safe, so one connection pool serves every wrapper and thread in the process.
+    boto3 itself is imported here, it takes a quarter second that nothing needs until S3 is actually used
+    '''
+
+    import boto3
+    from botocore.config import Config
+
+    key = (profile_name, region, endpoint_url)
+
+    with shared_clients_lock:
+
+        if key not in shared_clients:
+
+            config = Config(
+                region_name = region,
+                max_pool_connections = POOL_CONNECTIONS,
+                retries = {'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+                tcp_keepalive = True,
+            )
+
+            session = boto3.Session(profile_name=profile_name)
+
+            shared_clients[key] = session.client('s3', config=config, endpoint_url=endpoint_url)
+
+        return shared_clients[key]
+
 class S3Wrapper:
-    def __init__(self, bucket_name, profile_name='personal', region = 'us-east-2'):
+    def __init__(self, bucket_name, profile_name='personal', region = 'us-east-2', manifest_path = MANIFEST_PATH, listing_cache_path = LISTING_CACHE_PATH, multipart_threshold = MULTIPART_THRESHOLD, part_size = PART_SIZE, part_workers = PART_WORKERS, endpoint_url = None, defer_manifest = False):
         self.bucket_name = bucket_name
         self.region = region
-        self.session = boto3.Session(profile_name=profile_name)
-        self.s3_client = self.session.client('s3')
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.part_workers = part_workers
+        self.progress_callback = None
+        self.compression = COMPRESSION
+
+        # The client is made on first use, so building a wrapper never touches boto3, credentials or the network
+        self.profile_name = profile_name
+        self.endpoint_url = endpoint_url or os.environ.get(ENDPOINT_ENVIRONMENT_VARIABLE)
+        self._s3_client = None
+
+        # Upload manifest, maps file hash -> {s3 key: etag}. Loaded on first use, None path disables deduplication
+        self.manifest_path = manifest_path
+        self.manifest = None
+        self.manifest_lock = threading.Lock()
+
+        # With defer_manifest the manifest is only read. Changes to it are collected as (file hash, s3 key, etag or None once forgotten)
+        # for the one process that writes it to merge, see take_manifest_changes and merge_manifest_changes
+        self.defer_manifest = defer_manifest
+        self.manifest_changes = []
+
+        # Listing cache, maps prefix -> {'time': listed at, 'keys': [key, ...]}. None path disables it
+        self.listing_cache_path = listing_cache_path
+        self.listing_cache = None
+        self.listing_lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+
+        if self._s3_client is None:
+            self._s3_client = shared_client(self.profile_name, self.region, self.endpoint_url)
+
+        return self._s3_client
+
+    def url_for_key(self, s3_key):
+        """Public url of an object in the bucket"""
+        return os.path.join(f'https://{self.bucket_name}.s3.{self.region}.amazonaws.com/', s3_key).replace('\\', '/')
+
+    def iter_objects(self, prefix='', page_size = 1000):
+        """Stream the object summaries (Key, ETag, Size, LastModified) under a prefix, one page at a time
+
+        A page that fails raises its ClientError, so a failed listing is never mistaken for a shorter one"""
+
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, PaginationConfig={'PageSize': page_size}):
+            yield from page.get('Contents', [])
+
+    def iter_directory(self, prefix='', page_size = 1000):
+        """Stream the keys in a directory (prefix), without building the full list"""
+        for content in self.iter_objects(prefix, page_size):
+            yield content['Key']
+
+    @traced('s3.list_directory')
+    def list_directory(self, prefix='', use_cache = False):
+        """List objects in a directory (prefix)
+
+        With use_cache, a listing younger than LISTING_TTL is served from disk. Our own writes invalidate it,
+        anything else writing to the bucket shows up once the listing expires.
+        A listing that fails part way returns nothing, and is never cached"""
+
+        annotate(prefix = prefix)
+
+        if use_cache and self.listing_cache_path is not None:
+
+            cached = self._load_listing_cache().get(prefix)
+
+            if cached is not None and 'keys' in cached and time.time() - cached['time'] < LISTING_TTL:
+                return list(cached['keys'])
 
-    def list_directory(self, prefix=''):
-        """List objects in a directory (prefix)"""
         try:
-            response = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
-            return [content['Key'] for content in response.get('Contents', [])]
+            keys = list(self.iter_directory(prefix))
         except ClientError as e:
             print(f"Error listing directory: {e}")
             return []
 
+        if not use_cache or self.listing_cache_path is None:
+            return keys
+
+        with self.listing_lock:
+            self.listing_cache[prefix] = {'time': time.time(), 'keys': keys}
+            self._save_listing_cache()
+
+        return list(keys)
+
+    def _load_listing_cache(self):
+
+        with self.listing_lock:
+
+            if self.listing_cache is None:
+                try:
+                    with open(self.listing_cache_path) as cache_file:
+                        self.listing_cache = json.load(cache_file)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    self.listing_cache = {}
+
+            return self.listing_cache
+
+    def _save_listing_cache(self):
+        # Caller must hold listing_lock
+
+        os.makedirs(os.path.dirname(self.listing_cache_path) or '.', exist_ok = True)
+
+        with open(self.listing_cache_path + '.tmp', 'w') as cache_file:
+            json.dump(self.listing_cache, cache_file)
+
+        os.replace(self.listing_cache_path + '.tmp', self.listing_cache_path)
+
+    def invalidate_listing(self, s3_key):
+        """Drop every cached listing that would contain this key"""
+
+        if self.listing_cache_path is None:
+            return
+
+        cache = self._load_listing_cache()
+
+        with self.listing_lock:
+
+            stale = [prefix for prefix in cache if s3_key.startswith(prefix)]
+
+            if not stale:
+                return
+
+            for prefix in stale:
+                del cache[prefix]
+
+            self._save_listing_cache()
+
+    @traced('s3.create_folder')
     def create_folder(self, folder_name):
         """Create a folder by uploading an empty object with a trailing slash"""
         if not folder_name.endswith('/'):
             folder_name += '/'
-        # Check if folder already exists
-        existing_objects = self.list_directory(prefix=folder_name)
-        if existing_objects:
-            print(f"Folder '{folder_name}' already exists.")
-            return
         try:
+            # Check if folder already exists, one key is enough to tell
+            if next(self.iter_directory(prefix=folder_name, page_size=1), None) is not None:
+                print(f"Folder '{folder_name}' already exists.")
+                return
+
             self.s3_client.put_object(Bucket=self.bucket_name, Key=folder_name)
+            self.invalidate_listing(folder_name)
             print(f"Folder '{folder_name}' created successfully.")
         except ClientError as e:
             print(f"Error creating folder: {e}")
 
-    def upload_file(self, file_path, s3_key):
+    def content_encoding(self):
+        """The encoding text formats are precompressed with, or None to store them as they are"""
 
-        """Upload a file to S3"""
+        if self.compression == 'br' and brotli is None:
+            print("Warning: brotli is not installed, compressing with gzip instead.")
+            self.compression = 'gzip'
+
+        return self.compression
+
+    def publish_args(self, file_path, s3_key, cache_control = None):
+        """Headers to store an object with: its content type, cache policy, and encoding if it is precompressed"""
+
+        extension = file_type(file_path)
+
+        extra_args = {'CacheControl': cache_control or cache_control_for(s3_key)}
+
+        if extension in CONTENT_TYPES:
+            extra_args['ContentType'] = CONTENT_TYPES[extension]
+
+        if extension in COMPRESSIBLE_TYPES and self.content_encoding() is not None:
+            extra_args['ContentEncoding'] = self.content_encoding()
+
+        return extra_args
+
+    def _compress_for_upload(self, file_path, encoding):
+        """Compress a file into a temporary file, returning its path. The caller removes it"""
+
+        with open(file_path, 'rb') as source, tempfile.NamedTemporaryFile(suffix = '.' + file_type(file_path), delete = False) as destination:
+            compress_to_file(source, destination, encoding)
+
+        return destination.name
+
+    @traced('s3.upload_file')
+    def upload_file(self, file_path, s3_key, progress_callback = None, cache_control = None):
+
+        """Upload a file to S3
+
+        Objects are stored with their content type and a cache policy (cache_control, default: by key, see cache_control_for).
+        Text formats are precompressed with self.compression, and served with a matching Content-Encoding.
+        Files past the multipart threshold are sent as resumable multipart uploads.
+        progress_callback (default: self.progress_callback) is called with (file_path, bytes_transferred, total_bytes)"""
 
         s3_key = s3_key.replace('\\', '/') # s3 why you do this???
 
-        extra_args = {}
-        if file_path.lower().endswith('.pdf'):
-            extra_args = {
-                'ContentType': 'application/pdf',
-            }
+        if progress_callback is None:
+            progress_callback = self.progress_callback
+
+        annotate(key = s3_key)
+
+        extra_args = self.publish_args(file_path, s3_key, cache_control)
+
+        file_hash = None
+
+        if self.manifest_path is not None:
+            # Headers are part of what gets published, so changing them uploads the file again
+            file_hash = hashlib.sha256((hash_file(file_path) + json.dumps(extra_args, sort_keys = True)).encode()).hexdigest()
+
+            if self.is_uploaded(file_hash, s3_key):
+                print(f"File '{file_path}' unchanged at '{s3_key}', skipping upload.")
+                annotate(skipped = True)
+                return self.url_for_key(s3_key)
+
+        upload_path = file_path
 
         try:
-            self.s3_client.upload_file(file_path, self.bucket_name, s3_key, ExtraArgs=extra_args)
+            if 'ContentEncoding' in extra_args:
+                upload_path = self._compress_for_upload(file_path, extra_args['ContentEncoding'])
+
+            if os.path.getsize(upload_path) >= self.multipart_threshold:
+                self.multipart_upload(upload_path, s3_key, extra_args, progress_callback)
+            else:
+                self.s3_client.upload_file(upload_path, self.bucket_name, s3_key, ExtraArgs=extra_args, Callback=self._progress_counter(file_path, progress_callback, os.path.getsize(upload_path)))
             print(f"File '{file_path}' uploaded to '{s3_key}' successfully.")
 
-            return os.path.join(f'https://{self.bucket_name}.s3.{self.region}.amazonaws.com/', s3_key).replace('\\', '/')
+            add_bytes(os.path.getsize(upload_path))
+
+            self.invalidate_listing(s3_key)
+
+            if file_hash is not None:
+                self.record_upload(file_hash, s3_key)
+
+            return self.url_for_key(s3_key)
         except ClientError as e:
             print(f"Error uploading file: {e}")
+        finally:
+            if upload_path != file_path:
+                os.remove(upload_path)
+
+    def _progress_counter(self, file_path, progress_callback, total = None):
+        # boto3 reports byte increments, convert them to running totals
+
+        if progress_callback is None:
+            return None
+
+        if total is None:
+            total = os.path.getsize(file_path)
+        transferred = 0
+        lock = threading.Lock()
+
+        def count(byte_count):
+            nonlocal transferred
+
+            with lock:
+                transferred += byte_count
+                progress_callback(file_path, transferred, total)
+
+        return count
+
+    def _upload_state_path(self, s3_key):
+        return os.path.join(UPLOAD_STATE_DIRECTORY, hashlib.sha1(f'{self.bucket_name}/{s3_key}'.encode()).hexdigest() + '.json')
+
+    def _resume_multipart_upload(self, state_path, state):
+        """Return the completed parts of a previously interrupted upload, or None if it cannot be resumed"""
+
+        try:
+            with open(state_path) as state_file:
+                saved_state = json.load(state_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        for field in ('file_size', 'file_mtime', 'part_size'):
+            if saved_state.get(field) != state[field]:
+                self._abort_multipart_upload(state['key'], saved_state.get('upload_id'))
+                return None
 
+        # Trust S3 over the state file for which parts actually landed
+        try:
+            parts = {}
+
+            paginator = self.s3_client.get_paginator('list_parts')
+
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=state['key'], UploadId=saved_state['upload_id']):
+                for part in page.get('Parts', []):
+                    parts[str(part['PartNumber'])] = part['ETag']
+
+        except ClientError:
+            return None
+
+        state['upload_id'] = saved_state['upload_id']
+        state['parts'] = parts
+
+        return state
+
+    def _abort_multipart_upload(self, s3_key, upload_id):
+
+        if upload_id is None:
+            return
+
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id)
+        except ClientError:
+            pass
+
+    @traced('s3.multipart_upload')
+    def multipart_upload(self, file_path, s3_key, extra_args = None, progress_callback = None):
+        """Upload a file in parts, persisting progress so an interrupted upload resumes from its last completed part"""
+
+        file_size = os.path.getsize(file_path)
+
+        state_path = self._upload_state_path(s3_key)
+
+        state = {
+            'file_path': os.path.abspath(file_path),
+            'file_size': file_size,
+            'file_mtime': os.path.getmtime(file_path),
+            'part_size': self.part_size,
+            'key': s3_key,
+            'upload_id': None,
+            'parts': {},
+        }
+
+        resumed = self._resume_multipart_upload(state_path, state)
+
+        if resumed is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=s3_key, **(extra_args or {}))
+            state['upload_id'] = response['UploadId']
+        else:
+            print(f"Resuming upload of '{file_path}' with {len(state['parts'])} part(s) already sent.")
+
+        state_lock = threading.Lock()
+
+        def save_state():
+            os.makedirs(UPLOAD_STATE_DIRECTORY, exist_ok = True)
+
+            with open(state_path + '.tmp', 'w') as state_file:
+                json.dump(state, state_file)
+
+            os.replace(state_path + '.tmp', state_path)
+
+        save_state()
+
+        part_count = max(1, -(-file_size // self.part_size))
+
+        transferred = sum(min(self.part_size, file_size - (int(number) - 1) * self.part_size) for number in state['parts'])
+
+        if progress_callback is not None:
+            progress_callback(file_path, transferred, file_size)
+
+        def upload_part(part_number):
+            nonlocal transferred
+
+            with open(file_path, 'rb') as f:
+                f.seek((part_number - 1) * self.part_size)
+                body = f.read(self.part_size)
+
+            with span('s3.upload_part', key = s3_key, part = part_number, bytes = len(body)):
+                response = self.s3_client.upload_part(Bucket=self.bucket_name, Key=s3_key, UploadId=state['upload_id'], PartNumber=part_number, Body=body)
+
+            with state_lock:
+                state['parts'][str(part_number)] = response['ETag']
+                save_state()
+
+                transferred += len(body)
+
+                if progress_callback is not None:
+                    progress_callback(file_path, transferred, file_size)
+
+        remaining = [number for number in range(1, part_count + 1) if str(number) not in state['parts']]
+
+        with ThreadPoolExecutor(max_workers = self.part_workers) as pool:
+            # list() re-raises the first failure, the state file keeps every part that did finish
+            list(pool.map(upload_part, remaining))
+
+        parts = [{'PartNumber': int(number), 'ETag': etag} for number, etag in sorted(state['parts'].items(), key=lambda item: int(item[0]))]
+
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket_name, Key=s3_key, UploadId=state['upload_id'], MultipartUpload={'Parts': parts})
+
+        os.remove(state_path)
+
+    @traced('s3.load_manifest')
+    def load_manifest(self):
+        """Load the upload manifest, from the local copy if present, otherwise from its mirror in the bucket"""
+
+        with self.manifest_lock:
+
+            if self.manifest is not None:
+                return self.manifest
+
+            try:
+                with open(self.manifest_path) as manifest_file:
+                    self.manifest = json.load(manifest_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                try:
+                    response = self.s3_client.get_object(Bucket=self.bucket_name, Key=MANIFEST_KEY)
+                    self.manifest = json.loads(decode_body(response['Body'].read(), response.get('ContentEncoding')))
+                except ClientError:
+                    self.manifest = {}
+
+            return self.manifest
+
+    def _apply_manifest_change(self, file_hash, s3_key, etag):
+        # Caller must hold manifest_lock
+
+        if etag is None:
+            self.manifest.get(file_hash, {}).pop(s3_key, None)
+        else:
+            # The key now holds new content, drop it from any other hash
+            for keys in self.manifest.values():
+                keys.pop(s3_key, None)
+
+            self.manifest.setdefault(file_hash, {})[s3_key] = etag
+
+        self.manifest = {known_hash: keys for known_hash, keys in self.manifest.items() if keys}
+
+    def _change_manifest(self, file_hash, s3_key, etag):
+        # Caller must hold manifest_lock
+
+        self._apply_manifest_change(file_hash, s3_key, etag)
+
+        if self.defer_manifest:
+            self.manifest_changes.append((file_hash, s3_key, etag))
+        else:
+            self._save_manifest()
+
+    def _save_manifest(self):
+        # Caller must hold manifest_lock
+
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok = True)
+
+        temp_path = self.manifest_path + '.tmp'
+
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+
+        os.replace(temp_path, self.manifest_path)
+
+    @traced('s3.is_uploaded')
+    def is_uploaded(self, file_hash, s3_key):
+        """Check the manifest (and the object's live ETag) for an identical upload already at this key"""
+
+        etag = self.load_manifest().get(file_hash, {}).get(s3_key)
+
+        if etag is None:
+            return False
+
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+        except ClientError:
+            response = {}
+
+        if response.get('ETag') == etag:
+            return True
+
+        # Object was changed or removed behind our back, forget it
+        with self.manifest_lock:
+            self._change_manifest(file_hash, s3_key, None)
+
+        return False
+
+    @traced('s3.record_upload')
+    def record_upload(self, file_hash, s3_key):
+        """Store the hash and ETag of a completed upload in the manifest"""
+
+        self.load_manifest()
+
+        try:
+            etag = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)['ETag']
+        except ClientError as e:
+            print(f"Error reading uploaded file: {e}")
+            return
+
+        with self.manifest_lock:
+            self._change_manifest(file_hash, s3_key, etag)
+
+    def take_manifest_changes(self):
+        """The manifest changes deferred since the last call, see defer_manifest"""
+
+        with self.manifest_lock:
+            changes, self.manifest_changes = self.manifest_changes, []
+
+        return changes
+
+    @traced('s3.merge_manifest_changes')
+    def merge_manifest_changes(self, changes):
+        """Apply manifest changes deferred by other wrappers (worker processes), in order, and save the manifest once"""
+
+        changes = list(changes)
+
+        if self.manifest_path is None or not changes:
+            return
+
+        self.load_manifest()
+
+        with self.manifest_lock:
+
+            for file_hash, s3_key, etag in changes:
+                self._apply_manifest_change(file_hash, s3_key, etag)
+
+            self._save_manifest()
+
+    @traced('s3.push_manifest')
+    def push_manifest(self):
+        """Mirror the local upload manifest to the bucket"""
+
+        if self.manifest_path is None:
+            return
+
+        manifest = self.load_manifest()
+
+        with self.manifest_lock:
+            body = json.dumps(manifest)
+
+        self.write_json(MANIFEST_KEY, body)
+
+    @traced('s3.read_json')
+    def read_json(self, s3_key):
+        """Read and parse a JSON object straight from the bucket. Returns None if it is missing or invalid"""
+
+        s3_key = s3_key.replace('\\', '/') # s3 why you do this???
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+            body = response['Body'].read()
+            add_bytes(len(body))
+            return json.loads(decode_body(body, response.get('ContentEncoding')))
+        except ClientError as e:
+            print(f"Error reading file: {e}")
+        except json.JSONDecodeError as e:
+            print(f"Error parsing '{s3_key}': {e}")
+
+    @traced('s3.write_json')
+    def write_json(self, s3_key, data, cache_control = None):
+        """Write a JSON document (or an already encoded string) straight to the bucket, precompressed like upload_file"""
+
+        s3_key = s3_key.replace('\\', '/') # s3 why you do this???
+
+        body = data if isinstance(data, str) else json.dumps(data)
+
+        extra_args = self.publish_args(s3_key, s3_key, cache_control)
+
+        try:
+            body = body.encode()
+
+            if extra_args.get('ContentEncoding') == 'gzip':
+                body = gzip.compress(body, compresslevel = 9, mtime = 0)
+            elif extra_args.get('ContentEncoding') == 'br':
+                body = brotli.compress(body, quality = 11)
+
+            add_bytes(len(body))
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=s3_key, Body=body, **extra_args)
+            self.invalidate_listing(s3_key)
+            print(f"JSON written to '{s3_key}' successfully.")
+
+            return self.url_for_key(s3_key)
+        except ClientError as e:
+            print(f"Error writing file: {e}")
+
+    @traced('s3.delete_folder')
     def delete_folder(self, folder_name):
         """Delete a folder by removing all objects within it"""
         if not folder_name.endswith('/'):
             folder_name += '/'
         try:
-            objects = self.list_directory(prefix=folder_name)
+            # Collect every key before deleting, so pagination never runs over a shrinking listing.
+            # A failed listing raises, rather than leave part of the folder behind
+            objects = list(self.iter_directory(prefix=folder_name))
             if objects:
-                delete_objects = {'Objects': [{'Key': obj} for obj in objects]}
-                self.s3_client.delete_objects(Bucket=self.bucket_name, Delete=delete_objects)
+                for start in range(0, len(objects), DELETE_BATCH_SIZE):
+                    delete_objects = {'Objects': [{'Key': obj} for obj in objects[start: start + DELETE_BATCH_SIZE]]}
+                    response = self.s3_client.delete_objects(Bucket=self.bucket_name, Delete=delete_objects)
+
+                    for error in response.get('Errors', []):
+                        print(f"Error deleting file '{error.get('Key')}': {error.get('Message')}")
+
+                self.invalidate_listing(folder_name)
                 print(f"Folder '{folder_name}' and its contents deleted successfully.")
             else:
                 print(f"Folder '{folder_name}' is empty or does not exist.")
         except ClientError as e:
             print(f"Error deleting folder: {e}")
 
+    @traced('s3.delete_file')
     def delete_file(self, file_key):
         """Delete a file from S3"""
 
@@ -75,10 +796,12 @@ class S3Wrapper:
 
         try:
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=file_key)
+            self.invalidate_listing(file_key)
             print(f"File '{file_key}' deleted successfully.")
         except ClientError as e:
             print(f"Error deleting file: {e}")
 
+    @traced('s3.download_file')
     def download_file(self, s3_key, local_path):
         """Download a file from S3 to a specified local path"""
 
@@ -89,11 +812,43 @@ class S3Wrapper:
         os.makedirs(end_location, exist_ok = True)
 
         try:
-            self.s3_client.download_file(self.bucket_name, s3_key, local_path)
+            if file_type(s3_key) in COMPRESSIBLE_TYPES:
+                # May be precompressed, and is stored decoded so it can be edited locally
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+
+                with open(local_path, 'wb') as local_file:
+                    if response.get('ContentEncoding') in ('gzip', 'br'):
+                        decompress_to_file(response['Body'], local_file, response['ContentEncoding'])
+                    else:
+                        shutil.copyfileobj(response['Body'], local_file)
+            else:
+                self.s3_client.download_file(self.bucket_name, s3_key, local_path)
             print(f"File '{s3_key}' downloaded to '{local_path}' successfully.")
+
+            annotate(key = s3_key)
+            add_bytes(os.path.getsize(local_path))
+
+            return local_path
         except ClientError as e:
             print(f"Error downloading file: {e}")
+
+    @traced('s3.download_files')
+    def download_files(self, transfers, max_workers = TRANSFER_WORKERS):
+        """Download a batch of (s3_key, local_path) pairs concurrently
+
+        Returns a dict of s3_key -> local path, or None for each download that failed"""
+
+        transfers = list(transfers)
+
+        if not transfers:
+            return {}
+
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            results = pool.map(lambda transfer: self.download_file(*transfer), transfers)
+
+            return {s3_key: result for (s3_key, _), result in zip(transfers, results)}
     
+    @traced('s3.download_url_to_directory')
     def download_url_to_directory(self, url: str, directory: str):
         """Download a s3 url to a specified path. Does not change file name"""
 
@@ -103,7 +858,71 @@ class S3Wrapper:
 
         to_file = os.path.join(directory, file_name)
 
-        self.download_file(file_path, to_file)
+        return self.download_file(file_path, to_file)
+
+    @traced('s3.download_urls_to_directory')
+    def download_urls_to_directory(self, urls, directory: str, max_workers = TRANSFER_WORKERS):
+        """Download a batch of s3 urls into a directory concurrently, to the paths local_paths gives them
+
+        Returns a dict of url -> local path, or None for each download that failed"""
+
+        paths = local_paths(urls, directory)
+
+        urls = list(paths)
+
+        transfers = [(url.partition('amazonaws.com/')[2], paths[url]) for url in urls]
+
+        results = self.download_files(transfers, max_workers = max_workers)
+
+        return {url: results[s3_key] for url, (s3_key, _) in zip(urls, transfers)}
+
+    async def _gather_bounded(self, function, calls, max_concurrency):
+        # Runs the blocking calls on worker threads, no more than max_concurrency at once
+        # asyncio is imported here, like boto3 in shared_client, so the synchronous callers never pay for it
+        import asyncio
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(args):
+            async with semaphore:
+                return await asyncio.to_thread(function, *args)
+
+        results = await asyncio.gather(*(run(args) for args in calls), return_exceptions = True)
+
+        for args, result in zip(calls, results):
+            if isinstance(result, Exception):
+                print(f"Error transferring '{args[0]}': {result}")
+
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    async def upload_many(self, transfers, max_concurrency = TRANSFER_WORKERS):
+        """Upload (file_path, s3_key) pairs concurrently, from asyncio code
+
+        Returns a dict of s3_key -> url, or None for each upload that failed"""
+
+        transfers = list(transfers)
+
+        results = await self._gather_bounded(self.upload_file, transfers, max_concurrency)
+
+        return {s3_key: result for (_, s3_key), result in zip(transfers, results)}
+
+    async def download_many(self, transfers, max_concurrency = TRANSFER_WORKERS):
+        """Download (s3_key, local_path) pairs concurrently, from asyncio code
+
+        Returns a dict of s3_key -> local path, or None for each download that failed"""
+
+        transfers = list(transfers)
+
+        results = await self._gather_bounded(self.download_file, transfers, max_concurrency)
+
+        return {s3_key: result for (s3_key, _), result in zip(transfers, results)}
+
+    async def list(self, prefix='', use_cache = False):
+        """list_directory, from asyncio code"""
+
+        import asyncio
+
+        return await asyncio.to_thread(self.list_directory, prefix, use_cache)
 
 # Example usage
 if __name__ == "__main__":
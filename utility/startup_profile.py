@@ -0,0 +1,165 @@
+'''
+Where the time goes between launching a tool and it being ready to use.
+
+Once enable() is called, every module imported is timed (its own execution, not counting the imports it sets off),
+and stages of startup can be timed with stage(). report() prints both, along with the time to interactive:
+the time since this module was imported, less any stage spent waiting on the user.
+
+python gui.py --profile-startup
+'''
+
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+PROFILE_FLAG = '--profile-startup'
+
+REPORT_MODULES = 20
+
+process_start = time.perf_counter()
+
+enabled = False
+
+# Module name -> (self seconds, total seconds)
+module_times = {}
+
+# Per thread stack of the open imports, each holding the time taken by the imports it has set off so far
+import_stacks = threading.local()
+
+# (name, seconds, waiting) in the order they finished
+stage_times = []
+
+class TimedLoader:
+    '''Stands in for a module's loader, timing its execution'''
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+
+        import_stack = getattr(import_stacks, 'stack', None)
+
+        if import_stack is None:
+            import_stack = import_stacks.stack = []
+
+        import_stack.append(0)
+
+        start = time.perf_counter()
+
+        try:
+            self.loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+
+            nested = import_stack.pop()
+
+            if import_stack:
+                import_stack[-1] += total
+
+            module_times[module.__name__] = (total - nested, total)
+
+class TimingFinder:
+    '''Goes first on sys.meta_path, asking the finders behind it and wrapping whatever loader they find'''
+
+    def find_spec(self, name, path, target = None):
+
+        for finder in sys.meta_path:
+
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+
+            spec = finder.find_spec(name, path, target)
+
+            if spec is None:
+                continue
+
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = TimedLoader(spec.loader)
+
+            return spec
+
+        return None
+
+def enable():
+    '''Start timing imports. Only imports from here on are seen, so call it before anything heavy is imported'''
+
+    global enabled
+
+    if enabled:
+        return
+
+    enabled = True
+
+    sys.meta_path.insert(0, TimingFinder())
+
+def enable_from_arguments():
+    '''Enable profiling if the profile flag was passed, taking it out of sys.argv'''
+
+    if PROFILE_FLAG in sys.argv:
+        sys.argv.remove(PROFILE_FLAG)
+        enable()
+
+@contextmanager
+def stage(name, waiting = False):
+    '''Time a stage of startup. Waiting stages (prompts) are reported, but not counted towards time to interactive'''
+
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        stage_times.append((name, time.perf_counter() - start, waiting))
+
+def report():
+    '''Print the time to interactive, every stage, and the slowest imports, alone and grouped by package'''
+
+    if not enabled:
+        return
+
+    elapsed = time.perf_counter() - process_start
+
+    waited = sum(seconds for _, seconds, waiting in stage_times if waiting)
+
+    print()
+    print(f'Time to interactive: {elapsed - waited:.3f}s ({elapsed:.3f}s including {waited:.3f}s waiting on input)')
+
+    if stage_times:
+        print()
+        print('Stages:')
+
+        for name, seconds, waiting in stage_times:
+            print(f'  {seconds * 1000:9.1f} ms  {name}{" (waiting)" if waiting else ""}')
+
+    packages = {}
+
+    for name, (self_seconds, _) in module_times.items():
+        package = name.partition('.')[0]
+        packages[package] = packages.get(package, 0) + self_seconds
+
+    print()
+    print(f'Imports: {len(module_times)} module(s), {sum(packages.values()) * 1000:.1f} ms')
+
+    print()
+    print('Slowest packages:')
+
+    for package, seconds in sorted(packages.items(), key = lambda item: item[1], reverse = True)[:REPORT_MODULES]:
+        print(f'  {seconds * 1000:9.1f} ms  {package}')
+
+    print()
+    print('Slowest modules (self / including their imports):')
+
+    for name, (self_seconds, total) in sorted(module_times.items(), key = lambda item: item[1][0], reverse = True)[:REPORT_MODULES]:
+        print(f'  {self_seconds * 1000:9.1f} ms  {total * 1000:9.1f} ms  {name}')
+
+    print(flush = True)
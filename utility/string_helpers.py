@@ -1,4 +1,7 @@
-from typing import Tuple, Dict
+from typing import Tuple, Dict, List
+from bisect import bisect_right
+from functools import lru_cache
+import re
 
 def find_all_occurences(string: str, substring: str):
 
@@ -61,6 +64,168 @@ def quasi_equal_at_location(string:str , location: int, key: str):
     
     return True
 
+@lru_cache(maxsize = 64)
+def quasi_pattern(*keys: str):
+    '''
+    Compile a regex matching any of the keys, irrespective of spaces and case (see quasi_equal_at_location)
+    '''
+
+    for key in keys:
+        if ' ' in key:
+            raise ValueError('Spaces invalid for quasi equal')
+
+    alternatives = [' *'.join(re.escape(character) for character in key) for key in keys]
+
+    return re.compile('|'.join(alternatives), re.IGNORECASE)
+
+class QuasiView:
+    '''
+    Space and case insensitive view of a string: the string with its spaces removed and lowercased,
+    plus the offsets needed to map positions between the two.
+
+    Built once in linear time, after which any number of quasi searches run as plain string searches
+    '''
+
+    def __init__(self, string: str):
+
+        self.string = string
+
+        compact = string.replace(' ', '')
+
+        text = compact.lower()
+
+        if len(text) != len(compact):
+            # Some characters lowercase to several, keep those as they are so offsets still line up
+            text = ''.join(character.lower() if len(character.lower()) == 1 else character for character in compact)
+
+        self.text = text
+
+        # Each run of non space characters: where it starts in the string, and in the text
+        self.run_starts = []
+        self.run_text_starts = []
+
+        text_index = 0
+
+        for run in re.finditer('[^ ]+', string):
+            self.run_starts.append(run.start())
+            self.run_text_starts.append(text_index)
+
+            text_index += run.end() - run.start()
+
+    def to_text(self, location: int):
+        '''Text index of the first non space character at or after location'''
+
+        run_index = bisect_right(self.run_starts, location) - 1
+
+        if run_index == -1:
+            return 0
+
+        offset = location - self.run_starts[run_index]
+
+        run_length = self._run_text_end(run_index) - self.run_text_starts[run_index]
+
+        if offset < run_length:
+            return self.run_text_starts[run_index] + offset
+
+        return self._run_text_end(run_index)
+
+    def to_text_floor(self, location: int):
+        '''Text index of the last non space character at or before location, -1 if there is none'''
+
+        run_index = bisect_right(self.run_starts, location) - 1
+
+        if run_index == -1:
+            return -1
+
+        offset = location - self.run_starts[run_index]
+
+        return min(self.run_text_starts[run_index] + offset, self._run_text_end(run_index) - 1)
+
+    def to_string(self, text_index: int):
+        '''Location in the string of a text index'''
+
+        run_index = bisect_right(self.run_text_starts, text_index) - 1
+
+        return self.run_starts[run_index] + text_index - self.run_text_starts[run_index]
+
+    def _run_text_end(self, run_index: int):
+
+        if run_index + 1 < len(self.run_text_starts):
+            return self.run_text_starts[run_index + 1]
+
+        return len(self.text)
+
+class QuasiMatcher:
+    '''
+    Precompiled quasi search (see quasi_equal_at_location) for several keys at once, forwards or backwards over a QuasiView.
+
+    Where keys match at the same location, the earliest key given wins
+    '''
+
+    def __init__(self, keys: List[str]):
+
+        for key in keys:
+            if ' ' in key:
+                raise ValueError('Spaces invalid for quasi equal')
+
+        self.keys = list(keys)
+
+        self.lowered_keys = [key.lower() for key in self.keys]
+
+    def find(self, view: QuasiView, base_location = 0):
+        '''First (location, key) at or after base_location. (-1, None) if not found'''
+
+        start = view.to_text(max(base_location, 0))
+
+        best_index, best_key = -1, None
+
+        for key, lowered_key in zip(self.keys, self.lowered_keys):
+
+            index = view.text.find(lowered_key, start)
+
+            if index != -1 and (best_index == -1 or index < best_index):
+                best_index, best_key = index, key
+
+        if best_index == -1:
+            return -1, None
+
+        return view.to_string(best_index), best_key
+
+    def rfind(self, view: QuasiView, base_location: int):
+        '''Last (location, key) at or before base_location. (-1, None) if not found'''
+
+        end = view.to_text_floor(base_location)
+
+        if end == -1:
+            return -1, None
+
+        best_index, best_key = -1, None
+
+        for key, lowered_key in zip(self.keys, self.lowered_keys):
+
+            index = view.text.rfind(lowered_key, 0, end + len(lowered_key))
+
+            if index > best_index:
+                best_index, best_key = index, key
+
+        if best_index == -1:
+            return -1, None
+
+        return view.to_string(best_index), best_key
+
+# Views of the last few texts searched. Searches over the same text, as a compile makes many of, share one view
+QUASI_VIEW_CACHE_SIZE = 4
+
+@lru_cache(maxsize = QUASI_VIEW_CACHE_SIZE)
+def quasi_view(string: str):
+    '''The QuasiView of a string, built once for any number of searches over it'''
+
+    return QuasiView(string)
+
+@lru_cache(maxsize = 64)
+def quasi_matcher(*keys: str):
+    return QuasiMatcher(keys)
+
 def quasi_find(string: str, substring: str, base_location = 0):
     '''
     Find the first instance of a substring that is quasi equal.
@@ -71,12 +236,7 @@ def quasi_find(string: str, substring: str, base_location = 0):
     if len(substring) == 1:
         return string.find(substring, base_location + 1)
 
-    for index in range(base_location, len(string) - len(substring) + 1):
-
-        if quasi_equal_at_location(string, index, substring):
-            return index
-        
-    return -1
+    return quasi_matcher(substring).find(quasi_view(string), base_location)[0]
 
 def quasi_end_of_string(string: str, substring: str, start_of_string: int):
 
@@ -96,24 +256,10 @@ def optional_block_targeting(string: str, base_location: int, block_targets: Dic
 
     # Find reverse block
 
-    found_target = None
-
-    while found_target is None:
-
-        for block in block_targets:
-
-            if quasi_equal_at_location(string, base_location, block.lower()):
-
-                found_target = block
-
-                break
-
-        else:
-
-            base_location -= 1
+    base_location, found_target = quasi_matcher(*block_targets).rfind(quasi_view(string), base_location)
 
-            if base_location == -1:
-                raise IndexError('Blocks not found')
+    if found_target is None:
+        raise IndexError('Blocks not found')
     
     # Find end of block
 
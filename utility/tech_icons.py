@@ -0,0 +1,72 @@
+'''
+Technology icons, stored once and referenced by id.
+
+Each tech svg is minified and written to the icon directory, named by a hash of its markup.
+Projects list icon:<id> in place of the markup, and the project page fetches projects/icons/<id>.svg,
+which never changes once written, so browsers cache it across every project that uses it.
+
+Techs that are not svgs, and projects compiled before the registry, keep their markup inline
+'''
+
+import os
+import re
+import hashlib
+import tempfile
+
+ICON_DIRECTORY = '../projects/icons'
+ICON_KEY_PREFIX = 'projects/icons/'
+
+ICON_PREFIX = 'icon:'
+ICON_ID_LENGTH = 16
+
+# Prolog, doctype and comments, none of which render inline
+SVG_NOISE = re.compile(r'<\?xml.*?\?>|<!DOCTYPE[^>]*>|<!--.*?-->', re.DOTALL | re.IGNORECASE)
+SVG_TAG_GAPS = re.compile(r'>\s+<')
+
+def minify_svg(svg_text: str):
+    '''Drop the parts of an svg that do nothing inline, and the whitespace between its tags'''
+
+    return SVG_TAG_GAPS.sub('><', SVG_NOISE.sub('', svg_text)).strip()
+
+def is_icon_reference(tech: str):
+    return tech.startswith(ICON_PREFIX)
+
+def icon_path(reference: str, directory = ICON_DIRECTORY):
+    return os.path.join(directory, reference[len(ICON_PREFIX):] + '.svg')
+
+def icon_key(reference: str):
+    return ICON_KEY_PREFIX + reference[len(ICON_PREFIX):] + '.svg'
+
+def register_icon(tech: str, directory = ICON_DIRECTORY):
+    '''
+    The reference a project should list for a tech: icon:<id> for an svg, written to the registry if it is new.
+    References and anything that is not an svg are returned as they are
+    '''
+
+    if is_icon_reference(tech) or 'svg' not in tech:
+        return tech
+
+    svg_text = minify_svg(tech)
+
+    reference = ICON_PREFIX + hashlib.sha256(svg_text.encode()).hexdigest()[:ICON_ID_LENGTH]
+
+    path = icon_path(reference, directory)
+
+    if not os.path.exists(path):
+
+        os.makedirs(directory, exist_ok = True)
+
+        # Written beside its final name, so a concurrent compile never sees half an icon
+        descriptor, temp_path = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+
+        with open(descriptor, 'w', encoding = 'utf-8') as icon_file:
+            icon_file.write(svg_text)
+
+        os.replace(temp_path, path)
+
+    return reference
+
+def referenced_icons(techs):
+    '''The icon references among a project's techs, each once'''
+
+    return [tech for tech in dict.fromkeys(techs) if is_icon_reference(tech)]
@@ -0,0 +1,69 @@
+'''
+Content flags compile to the same bytes as the original compiler, which replaced one flag at a time.
+
+Each corpus/<name>.html is that compiler's output for corpus/<name>.qhtml. The only change made to the output since
+is the preload hint on videos, so the goldens were written with its video templates brought up to date.
+The flagged files are in corpus/assets, resolved from the working directory like any other compile
+'''
+
+import os
+import shutil
+
+import pytest
+
+from project_compiler import LinkCompiler
+
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+CASES = sorted(name[:-len('.qhtml')] for name in os.listdir(CORPUS_DIRECTORY) if name.endswith('.qhtml'))
+
+# Small enough that flags, and the newlines ending them, are split across chunks
+STREAM_CHUNK_SIZE = 7
+
+@pytest.fixture
+def corpus_site(tmp_path, monkeypatch):
+    '''Runs the test from a utility directory holding the corpus assets. Local compiles copy them into ../projects/temp'''
+
+    utility_directory = tmp_path / 'utility'
+
+    shutil.copytree(os.path.join(CORPUS_DIRECTORY, 'assets'), utility_directory / 'assets')
+
+    monkeypatch.chdir(utility_directory)
+
+    return tmp_path
+
+def read_case(name: str):
+
+    with open(os.path.join(CORPUS_DIRECTORY, name + '.qhtml'), newline = '') as qhtml_file:
+        qhtml = qhtml_file.read()
+
+    with open(os.path.join(CORPUS_DIRECTORY, name + '.html'), 'rb') as golden_file:
+        golden = golden_file.read()
+
+    return qhtml, golden
+
+def corpus_compiler():
+    # Image variants and video posters add to the output, the corpus covers the flags alone
+    return LinkCompiler(None, 'corpus-bucket', responsive_images = False, video_posters = False)
+
+@pytest.mark.parametrize('name', CASES)
+def test_compile_forward_matches_golden(corpus_site, name):
+
+    qhtml, golden = read_case(name)
+
+    assert corpus_compiler().compile_forward(qhtml, 'corpus').encode() == golden
+
+@pytest.mark.parametrize('name', CASES)
+def test_compile_forward_chunks_matches_golden(corpus_site, name):
+
+    qhtml, golden = read_case(name)
+
+    chunks = lambda: (qhtml[start: start + STREAM_CHUNK_SIZE] for start in range(0, len(qhtml), STREAM_CHUNK_SIZE))
+
+    assert ''.join(corpus_compiler().compile_forward_chunks(chunks, 'corpus')).encode() == golden
+
+def test_flagged_files_are_migrated(corpus_site):
+
+    corpus_compiler().compile_forward(read_case('media')[0], 'corpus')
+
+    assert sorted(os.listdir(corpus_site / 'projects' / 'temp')) == ['clip.mov', 'demo.mp4', 'design notes.pdf']
@@ -0,0 +1,172 @@
+'''
+Timing spans for the compiler and the S3 wrapper.
+
+Tracing is off until start_trace() is called, and spans cost next to nothing while it is off.
+A run is exported as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev), or as json lines when the path ends in .jsonl
+
+Setting the TRACE_PATH environment variable traces the whole process, and writes the file on exit
+'''
+
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+
+TRACE_ENVIRONMENT_VARIABLE = 'TRACE_PATH'
+
+trace_lock = threading.Lock()
+
+# None while tracing is off, otherwise the finished events of this run
+trace_events = None
+
+# Per thread stack of the open spans, so add_bytes knows where to count
+span_stack = threading.local()
+
+def tracing_enabled():
+    return trace_events is not None
+
+def start_trace():
+    '''Begin recording spans, dropping anything recorded before'''
+
+    global trace_events
+
+    with trace_lock:
+        trace_events = []
+
+def drain_events():
+    '''Take every event recorded so far, leaving tracing on'''
+
+    global trace_events
+
+    with trace_lock:
+
+        if trace_events is None:
+            return []
+
+        events, trace_events = trace_events, []
+
+        return events
+
+def merge_events(events):
+    '''Add events recorded elsewhere (another process) to this run'''
+
+    with trace_lock:
+
+        if trace_events is not None:
+            trace_events.extend(events)
+
+def stop_trace(path = None):
+    '''Stop recording. Writes the run to path if one is given, and returns its events'''
+
+    global trace_events
+
+    with trace_lock:
+        events, trace_events = trace_events or [], None
+
+    if path is not None:
+        export_trace(events, path)
+
+    return events
+
+def export_trace(events, path):
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+
+    events = sorted(events, key = lambda event: event['ts'])
+
+    with open(path, 'w') as trace_file:
+
+        if path.endswith('.jsonl'):
+            for event in events:
+                trace_file.write(json.dumps(event) + '\n')
+        else:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    print(f'Trace of {len(events)} span(s) written to {path}')
+
+def add_bytes(byte_count):
+    '''Count bytes moved against the innermost open span of this thread'''
+
+    stack = getattr(span_stack, 'spans', None)
+
+    if stack:
+        stack[-1]['bytes'] = stack[-1].get('bytes', 0) + byte_count
+
+def annotate(**args):
+    '''Attach details to the innermost open span of this thread'''
+
+    stack = getattr(span_stack, 'spans', None)
+
+    if stack:
+        stack[-1].update(args)
+
+@contextmanager
+def span(name, **args):
+    '''Time a block as a named span. Keyword arguments are kept with it, bytes can be added with add_bytes'''
+
+    if trace_events is None:
+        yield args
+        return
+
+    stack = getattr(span_stack, 'spans', None)
+
+    if stack is None:
+        stack = span_stack.spans = []
+
+    stack.append(args)
+
+    start = time.perf_counter_ns()
+
+    try:
+        yield args
+    except BaseException as e:
+        args['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        duration = time.perf_counter_ns() - start
+
+        stack.pop()
+
+        event = {
+            'name': name,
+            'cat': name.partition('.')[0],
+            'ph': 'X',
+            'ts': start / 1000,
+            'dur': duration / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+
+        with trace_lock:
+            if trace_events is not None:
+                trace_events.append(event)
+
+def traced(name):
+    '''Decorator form of span, for timing every call of a function'''
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def trace_from_environment():
+    '''Start tracing if TRACE_PATH is set, writing the trace there when the process exits'''
+
+    path = os.environ.get(TRACE_ENVIRONMENT_VARIABLE)
+
+    if not path:
+        return
+
+    start_trace()
+
+    atexit.register(stop_trace, path)